@@ -1,21 +1,41 @@
+import asyncio
 import os
-from mistralai import Mistral
-from dotenv import load_dotenv
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.deadline import Deadline, DeadlineExceeded, STAGE_MIN_BUDGET
+from app.metrics import increment, observe
+from app.profiling import record_stage
+from app.transport import get_async_client
+from app.tokens import STAGE_INPUT_BUDGETS, estimate_tokens, fit_to_budget
 
-load_dotenv()
+MODEL_NAME = "mistral-small-latest"
 
-api_key = os.getenv("MISTRAL_API_KEY")
-if not api_key:
-    raise ValueError("MISTRAL_API_KEY environment variable not set!")
+# Used when the analysis can't be parsed or there is no time to run it
+DEFAULT_ANALYSIS = {
+    "tone": "neutral",
+    "intent": "sharing",
+    "topics": ["general"],
+    "audience": "general public",
+    "context": "social media post"
+}
 
-MODEL_NAME = "mistral-small-latest"
+# Speculative drafting: write the draft from the platform's typical analysis
+# while the real analysis runs, and keep it if the two agree closely enough
+SPECULATIVE_DRAFT = os.getenv("SPECULATIVE_DRAFT", "false").lower() in ("1", "true", "yes")
+SPECULATION_THRESHOLD = float(os.getenv("SPECULATION_THRESHOLD", "0.67"))
 
-client = Mistral(api_key=api_key)
+# No topics: a speculative draft takes them from the post itself
+PLATFORM_DEFAULT_ANALYSIS = {
+    "linkedin": dict(DEFAULT_ANALYSIS, tone="professional", audience="professionals", topics=None),
+    "twitter": dict(DEFAULT_ANALYSIS, tone="casual", audience="general public", topics=None),
+    "instagram": dict(DEFAULT_ANALYSIS, tone="excited", audience="friends and followers", topics=None),
+}
 
-async def analyze_post(post_text: str) -> dict:
-    """Analyze the post to determine tone, intent, and context"""
-    
-    analysis_prompt = """Analyze this social media post in detail with the following structure:
+# The coarse fields the draft prompt depends on
+SPECULATION_FIELDS = ("tone", "intent", "audience")
+
+ANALYSIS_PROMPT = """Analyze this social media post in detail with the following structure:
     1) TONE: The primary emotional tone (excited, professional, casual, frustrated, etc.)
     2) INTENT: The main purpose (sharing information, asking question, celebrating, venting, etc.)
     3) TOPICS: Key topics, entities, or concepts mentioned
@@ -24,14 +44,73 @@ async def analyze_post(post_text: str) -> dict:
     
     Format your analysis as JSON with these exact keys: tone, intent, topics, audience, context.
     """
+
+# Platform-specific personas
+PERSONAS = {
+    "linkedin": "a thoughtful professional with expertise in the post topic",
+    "twitter": "a witty, engaged user who likes quick, impactful exchanges",
+    "instagram": "a supportive, visual-oriented person who uses emojis naturally"
+}
+
+# Output allowance per platform for the combined fan-out completion
+FANOUT_MAX_TOKENS_PER_PLATFORM = 160
+
+# Created on first use so importing this module stays cheap and doesn't need
+# secrets; one per event loop because each wraps that loop's pooled HTTP client
+_clients = weakref.WeakKeyDictionary()
+
+def get_client():
+    """Return the running event loop's Mistral client, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    # Rebuilt if the loop's pooled HTTP client was closed (app.transport.close_clients)
+    if client is None or client.sdk_configuration.async_client.is_closed:
+        from mistralai import Mistral
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = os.getenv("MISTRAL_API_KEY")
+        if not api_key:
+            raise ValueError("MISTRAL_API_KEY environment variable not set!")
+        client = _clients[loop] = Mistral(api_key=api_key, async_client=get_async_client("mistral"))
+    return client
+
+async def _complete(stage: str, deadline: Optional[Deadline] = None, reserve: float = 0.0, **kwargs):
+    """
+    Run one chat completion, cut off when the deadline (less `reserve` seconds
+    kept for later stages) runs out. Calls abandoned mid-flight are counted as
+    wasted upstream calls.
+    """
+    timeout = max(deadline.remaining() - reserve, 0.0) if deadline else None
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(
+            get_client().chat.complete_async(model=MODEL_NAME, **kwargs),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        increment("wasted_upstream_calls")
+        increment(f"wasted_upstream_calls_{stage}")
+        raise DeadlineExceeded(f"{stage} stage ran out of time")
+    except asyncio.CancelledError:
+        increment("wasted_upstream_calls")
+        increment(f"wasted_upstream_calls_{stage}")
+        raise
+    finally:
+        record_stage(f"mistral_{stage}", time.perf_counter() - start)
+
+async def analyze_post(post_text: str, deadline: Optional[Deadline] = None, reserve: float = 0.0) -> dict:
+    """Analyze the post to determine tone, intent, and context"""
     
     messages = [
-        {"role": "system", "content": analysis_prompt},
-        {"role": "user", "content": post_text}
+        {"role": "system", "content": ANALYSIS_PROMPT},
+        {"role": "user", "content": fit_to_budget("analyze", post_text)}
     ]
     
-    response = client.chat.complete(
-        model=MODEL_NAME,
+    response = await _complete(
+        "analyze",
+        deadline,
+        reserve,
         messages=messages,
         temperature=0.3,
         max_tokens=200
@@ -44,34 +123,45 @@ async def analyze_post(post_text: str) -> dict:
         return analysis
     except:
         # Fallback if JSON parsing fails
-        return {
-            "tone": "neutral",
-            "intent": "sharing",
-            "topics": ["general"],
-            "audience": "general public",
-            "context": "social media post"
-        }
-
-async def personalize_reply(platform: str, post_text: str, analysis: dict) -> str:
+        return dict(DEFAULT_ANALYSIS)
+
+async def personalize_reply(platform: str, post_text: str, analysis: dict,
+                            deadline: Optional[Deadline] = None, reserve: float = 0.0) -> str:
     """Generate a persona-specific reply based on platform and analysis"""
     
-    # Define platform-specific personas
-    personas = {
-        "linkedin": "a thoughtful professional with expertise in the post topic",
-        "twitter": "a witty, engaged user who likes quick, impactful exchanges",
-        "instagram": "a supportive, visual-oriented person who uses emojis naturally"
-    }
+    persona_prompt = _persona_prompt(platform, analysis)
     
-    persona = personas.get(platform.lower(), "a typical social media user")
+    messages = [
+        {"role": "system", "content": persona_prompt},
+        {"role": "user", "content": fit_to_budget("personalize", post_text)}
+    ]
     
-    persona_prompt = f"""
-    You are {persona} responding to a post on {platform}.
+    response = await _complete(
+        "personalize",
+        deadline,
+        reserve,
+        messages=messages,
+        temperature=0.7,
+        max_tokens=120
+    )
     
-    The post has the following characteristics:
+    return response.choices[0].message.content.strip()
+
+def _describe_analysis(analysis: dict) -> str:
+    topics = analysis.get('topics', ['general'])
+    topics_line = f"\n    - Main topics: {', '.join(topics)}" if topics is not None else ""
+    return f"""The post has the following characteristics:
     - Tone: {analysis.get('tone', 'neutral')}
-    - Intent: {analysis.get('intent', 'sharing')}
-    - Main topics: {', '.join(analysis.get('topics', ['general']))}
-    - Target audience: {analysis.get('audience', 'general')}
+    - Intent: {analysis.get('intent', 'sharing')}{topics_line}
+    - Target audience: {analysis.get('audience', 'general')}"""
+
+def _persona_prompt(platform: str, analysis: dict) -> str:
+    persona = PERSONAS.get(platform.lower(), "a typical social media user")
+    
+    return f"""
+    You are {persona} responding to a post on {platform}.
+    
+    {_describe_analysis(analysis)}
     
     Craft a reply that:
     1. Shows authentic engagement with the specific content
@@ -85,28 +175,47 @@ async def personalize_reply(platform: str, post_text: str, analysis: dict) -> st
     - Excessive enthusiasm or too many exclamation marks
     - Obviously AI-generated patterns like "As an AI language model..."
     """
+
+async def refine_reply(draft_reply: str, platform: str, deadline: Optional[Deadline] = None) -> str:
+    """Refine the draft reply to ensure it's truly authentic and platform-appropriate"""
     
+    # The draft is sent once, as the user message, rather than also being quoted here
     messages = [
-        {"role": "system", "content": persona_prompt},
-        {"role": "user", "content": post_text}
+        {"role": "system", "content": _refinement_prompt(platform)},
+        {"role": "user", "content": draft_reply}
     ]
+    saved = estimate_tokens(draft_reply)
+    increment("prompt_tokens_saved", saved)
+    increment("prompt_tokens_saved_refine", saved)
     
-    response = client.chat.complete(
-        model=MODEL_NAME,
+    response = await _complete(
+        "refine",
+        deadline,
         messages=messages,
-        temperature=0.7,
+        temperature=0.5,
         max_tokens=120
     )
     
     return response.choices[0].message.content.strip()
 
-async def refine_reply(draft_reply: str, platform: str) -> str:
-    """Refine the draft reply to ensure it's truly authentic and platform-appropriate"""
-    
-    refinement_prompt = f"""
-    Review this draft reply for {platform} and improve it to sound completely authentic:
-    
-    "{draft_reply}"
+async def generate_variants(platform: str, reply: str, n: int, deadline: Optional[Deadline] = None) -> List[str]:
+    """Sample `n` alternative versions of a finished reply in one refine completion"""
+    response = await _complete(
+        "variants",
+        deadline,
+        messages=[
+            {"role": "system", "content": _refinement_prompt(platform)},
+            {"role": "user", "content": reply}
+        ],
+        temperature=0.9,
+        max_tokens=120,
+        n=n
+    )
+    return [choice.message.content.strip() for choice in response.choices]
+
+def _refinement_prompt(platform: str) -> str:
+    return f"""
+    Review the draft reply for {platform} in the user message and improve it to sound completely authentic.
     
     Make these specific improvements:
     1. Adjust length to match typical {platform} replies (shorter for Twitter, more detailed for LinkedIn)
@@ -116,31 +225,204 @@ async def refine_reply(draft_reply: str, platform: str) -> str:
     
     Return only the refined reply text with no explanations.
     """
+
+async def _analysis_stage(post_text: str, deadline: Optional[Deadline]) -> Tuple[dict, bool, bool]:
+    """
+    Analysis, or DEFAULT_ANALYSIS if it would eat into the draft's time or ran
+    out of it. Also says whether a call was made and whether its analysis came back.
+    """
+    draft_reserve = STAGE_MIN_BUDGET["personalize"]
+    if deadline is not None and not deadline.allows("analyze", reserve=draft_reserve):
+        increment("stage_skipped_analyze")
+        return dict(DEFAULT_ANALYSIS), False, False
+    try:
+        return await analyze_post(post_text, deadline, reserve=draft_reserve), True, True
+    except DeadlineExceeded:
+        return dict(DEFAULT_ANALYSIS), True, False
+
+def analysis_similarity(analysis: Any, expected: dict) -> float:
+    """
+    Share of SPECULATION_FIELDS on which `analysis` agrees with `expected`; a
+    field agrees as far as its expected words appear in the actual value
+    """
+    if not isinstance(analysis, dict):
+        return 0.0
+    score = 0.0
+    for field in SPECULATION_FIELDS:
+        expected_words = set(str(expected[field]).lower().split())
+        actual_words = set(str(analysis.get(field, "")).lower().replace(",", " ").split())
+        score += len(expected_words & actual_words) / len(expected_words)
+    return score / len(SPECULATION_FIELDS)
+
+async def _timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+def _abandon(task: asyncio.Task) -> None:
+    task.cancel()
+    # Mark a failure as retrieved so it isn't logged as unhandled
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def _speculative_draft(platform: str, post_text: str, deadline: Optional[Deadline],
+                             on_stage: Optional[Callable[[str, Any], None]]) -> str:
+    """
+    Draft from the platform's default analysis while the real analysis runs.
+    The draft is kept if the analysis is similar enough to the default, or
+    was skipped or timed out; otherwise it is redone with the real one.
+    """
+    if deadline is not None and not deadline.allows("personalize"):
+        raise DeadlineExceeded("not enough time left to draft a reply")
+    expected = PLATFORM_DEFAULT_ANALYSIS[platform.lower()]
+    start = time.perf_counter()
+    draft_task = asyncio.create_task(_timed(personalize_reply(platform, post_text, expected, deadline)))
+    try:
+        analysis, _, analyzed = await _analysis_stage(post_text, deadline)
+    except BaseException:
+        _abandon(draft_task)
+        raise
+    analysis_seconds = time.perf_counter() - start
+    if on_stage:
+        on_stage("analysis", analysis)
+
+    increment(f"speculation_attempts_{platform}")
+    if not analyzed or analysis_similarity(analysis, expected) >= SPECULATION_THRESHOLD:
+        draft_reply, draft_seconds = await draft_task
+        increment(f"speculation_hits_{platform}")
+        # Against running the two stages back to back
+        observe(f"speculation_saved_seconds_{platform}",
+                max(analysis_seconds + draft_seconds - (time.perf_counter() - start), 0.0))
+        return draft_reply
+
+    _abandon(draft_task)
+    increment(f"speculation_misses_{platform}")
+    if deadline is not None and not deadline.allows("personalize"):
+        raise DeadlineExceeded("not enough time left to redo the draft")
+    return await personalize_reply(platform, post_text, analysis, deadline)
+
+async def generate_reply(platform: str, post_text: str, deadline: Optional[Deadline] = None,
+                         on_stage: Optional[Callable[[str, Any], None]] = None) -> str:
+    """
+    Generate a human-like reply using an advanced 3-stage approach.
+
+    With a deadline, optional stages give way to the required draft: analysis
+    falls back to DEFAULT_ANALYSIS and refinement returns the draft as-is when
+    the remaining budget is too small. `on_stage(stage, result)` is called with
+    the analysis and the draft as they complete, for streaming partial output.
+    """
+    if SPECULATIVE_DRAFT and platform.lower() in PLATFORM_DEFAULT_ANALYSIS:
+        # Stages 1 and 2 in parallel
+        draft_reply = await _speculative_draft(platform, post_text, deadline, on_stage)
+    else:
+        # Stage 1: Analyze the post in detail
+        analysis, _, _ = await _analysis_stage(post_text, deadline)
+        if on_stage:
+            on_stage("analysis", analysis)
+
+        # Stage 2: Generate a persona-based draft reply (required)
+        if deadline is not None and not deadline.allows("personalize"):
+            raise DeadlineExceeded("not enough time left to draft a reply")
+        draft_reply = await personalize_reply(platform, post_text, analysis, deadline)
+    if on_stage:
+        on_stage("draft", draft_reply)
     
-    messages = [
-        {"role": "system", "content": refinement_prompt},
-        {"role": "user", "content": draft_reply}
-    ]
-    
-    response = client.chat.complete(
-        model=MODEL_NAME,
-        messages=messages,
-        temperature=0.5,
-        max_tokens=120
-    )
+    # Stage 3: Refine the reply for maximum authenticity
+    if deadline is not None and not deadline.allows("refine"):
+        increment("stage_skipped_refine")
+        return draft_reply
+    try:
+        final_reply = await refine_reply(draft_reply, platform, deadline)
+    except DeadlineExceeded:
+        return draft_reply
     
-    return response.choices[0].message.content.strip()
+    return final_reply
 
-async def generate_reply(platform: str, post_text: str) -> str:
-    """Generate a human-like reply using an advanced 3-stage approach"""
+def _fan_out_prompt(platforms: List[str], analysis: dict) -> str:
+    voices = "\n".join(
+        f"    - {platform}: {PERSONAS.get(platform, 'a typical social media user')}" for platform in platforms
+    )
+    return f"""
+    Write one reply to the post in the user message for each of these platforms, each in its own voice:
+{voices}
     
-    # Stage 1: Analyze the post in detail
-    analysis = await analyze_post(post_text)
+    {_describe_analysis(analysis)}
     
-    # Stage 2: Generate a persona-based draft reply
-    draft_reply = await personalize_reply(platform, post_text, analysis)
+    Each reply should:
+    1. Show authentic engagement with the specific content
+    2. Match its platform's style and length (shorter for Twitter, more detailed for LinkedIn)
+    3. Add meaningful perspective or ask a thoughtful question
+    4. Sound completely human, with natural contractions and varied sentences
     
-    # Stage 3: Refine the reply for maximum authenticity
-    final_reply = await refine_reply(draft_reply, platform)
+    Avoid generic or templated replies, overly formal language, excessive enthusiasm,
+    and obviously AI-generated patterns. The replies must not copy each other.
     
-    return final_reply
+    Return a JSON object whose keys are exactly: {', '.join(platforms)}. Each value is only the reply text.
+    """
+
+async def fan_out_replies(platforms: List[str], post_text: str,
+                          deadline: Optional[Deadline] = None) -> Tuple[Dict[str, str], dict]:
+    """
+    Replies for several platforms from one analysis and one structured
+    completion, instead of analyze, personalize and refine per platform.
+    Platforms missing from the completion fall back to `personalize_reply`.
+    Returns the replies and what was saved against separate requests:
+    `calls_saved` and estimated `tokens_saved` (prompt tokens).
+    """
+    analysis, called, _ = await _analysis_stage(post_text, deadline)
+
+    if deadline is not None and not deadline.allows("personalize"):
+        raise DeadlineExceeded("not enough time left to draft replies")
+    prompt = _fan_out_prompt(platforms, analysis)
+    user_content = fit_to_budget("personalize", post_text)
+    response = await _complete(
+        "fanout",
+        deadline,
+        messages=[
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": user_content}
+        ],
+        temperature=0.7,
+        max_tokens=FANOUT_MAX_TOKENS_PER_PLATFORM * len(platforms),
+        response_format={"type": "json_object"}
+    )
+
+    try:
+        import json
+        parsed = json.loads(response.choices[0].message.content.strip())
+    except:
+        parsed = {}
+    replies = {
+        platform: parsed[platform].strip()
+        for platform in platforms
+        if isinstance(parsed.get(platform), str) and parsed[platform].strip()
+    }
+
+    missing = [platform for platform in platforms if platform not in replies]
+    if missing:
+        increment("fanout_fallbacks", len(missing))
+        drafts = await asyncio.gather(*(
+            personalize_reply(platform, post_text, analysis, deadline) for platform in missing
+        ))
+        replies.update(zip(missing, drafts))
+
+    # Prompt tokens as estimated by app.tokens: separate requests would each
+    # send the post to analyze and personalize, and the draft to refine
+    analyze_tokens = estimate_tokens(ANALYSIS_PROMPT) + min(estimate_tokens(post_text), STAGE_INPUT_BUDGETS["analyze"])
+    post_tokens = estimate_tokens(user_content)
+    separate_tokens = sum(
+        analyze_tokens + estimate_tokens(_persona_prompt(platform, analysis)) + post_tokens
+        + estimate_tokens(_refinement_prompt(platform)) + estimate_tokens(replies[platform])
+        for platform in platforms
+    )
+    used_tokens = (
+        analyze_tokens * called + estimate_tokens(prompt) + post_tokens
+        + sum(estimate_tokens(_persona_prompt(platform, analysis)) + post_tokens for platform in missing)
+    )
+    savings = {
+        "calls_saved": 3 * len(platforms) - (int(called) + 1 + len(missing)),
+        "tokens_saved": max(separate_tokens - used_tokens, 0)
+    }
+    increment("fanout_requests")
+    increment("fanout_calls_saved", savings["calls_saved"])
+    increment("fanout_tokens_saved", savings["tokens_saved"])
+    return replies, savings
@@ -1,12 +1,31 @@
 import hashlib
+import os
+import random
 import time
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 import json
 
+from app.metrics import increment, set_gauge
+
 # Simple in-memory cache
 cache: Dict[str, Tuple[Any, float]] = {}
 CACHE_EXPIRY = 60 * 60 * 24  # 24 hours in seconds
 
+# Variant pools: once a cached key has been requested VARIANT_HOT_THRESHOLD
+# times, up to VARIANT_POOL_SIZE alternative replies are generated for it in
+# the background and served in turn, so repeats don't all get the same text.
+# 0 disables the mode. Request counts are halved by every cache cleanup, so
+# hotness follows recent traffic, and once VARIANT_MAX_POOLS are kept a new
+# pool is only made for a key hotter than the coldest pooled one.
+VARIANT_POOL_SIZE = int(os.getenv("VARIANT_POOL_SIZE", "0"))
+VARIANT_HOT_THRESHOLD = int(os.getenv("VARIANT_HOT_THRESHOLD", "3"))
+VARIANT_MAX_POOLS = int(os.getenv("VARIANT_MAX_POOLS", "1000"))
+VARIANT_SERVE_MODE = os.getenv("VARIANT_SERVE_MODE", "round_robin")  # or "random"
+
+variant_pools: Dict[str, Dict[str, Any]] = {}
+request_counts: Dict[str, int] = {}
+_filling: set = set()
+
 def generate_cache_key(platform: str, post_text: str) -> str:
     """Generate a unique cache key based on platform and post text"""
     combined = f"{platform.lower()}:{post_text}"
@@ -21,10 +40,17 @@ def get_cached_reply(platform: str, post_text: str) -> Optional[str]:
         
         # Check if cache is still valid
         if time.time() - timestamp < CACHE_EXPIRY:
+            if VARIANT_POOL_SIZE:
+                request_counts[cache_key] = request_counts.get(cache_key, 0) + 1
+                variant = _next_variant(cache_key)
+                if variant is not None:
+                    return variant
             return cached_value
         
         # Remove expired cache entry
         del cache[cache_key]
+        variant_pools.pop(cache_key, None)
+        request_counts.pop(cache_key, None)
     
     return None
 
@@ -33,6 +59,73 @@ def cache_reply(platform: str, post_text: str, reply: str) -> None:
     cache_key = generate_cache_key(platform, post_text)
     cache[cache_key] = (reply, time.time())
 
+def _next_variant(cache_key: str) -> Optional[str]:
+    pool = variant_pools.get(cache_key)
+    if pool is None:
+        return None
+    replies = pool["replies"]
+    if VARIANT_SERVE_MODE == "random":
+        reply = random.choice(replies)
+    else:
+        reply = replies[pool["next"] % len(replies)]
+        pool["next"] += 1
+    increment("variant_replies_served")
+    return reply
+
+def _coldest_pool() -> Optional[str]:
+    return min(variant_pools, key=lambda key: request_counts.get(key, 0), default=None)
+
+def _admits(cache_key: str) -> bool:
+    """Room for another pool, or the key is hotter than the coldest pooled key"""
+    if len(variant_pools) < VARIANT_MAX_POOLS:
+        return True
+    coldest = _coldest_pool()
+    return coldest is not None and request_counts.get(cache_key, 0) > request_counts.get(coldest, 0)
+
+def claim_variant_fill(platform: str, post_text: str) -> bool:
+    """
+    True if the key is hot, has no pool yet, would be admitted and nobody is
+    filling one; the caller then owns the fill and must call
+    `release_variant_fill` when done
+    """
+    cache_key = generate_cache_key(platform, post_text)
+    if (not VARIANT_POOL_SIZE or cache_key not in cache or cache_key in variant_pools
+            or cache_key in _filling or request_counts.get(cache_key, 0) < VARIANT_HOT_THRESHOLD
+            or not _admits(cache_key)):
+        return False
+    _filling.add(cache_key)
+    return True
+
+def release_variant_fill(platform: str, post_text: str) -> None:
+    _filling.discard(generate_cache_key(platform, post_text))
+
+def store_variants(platform: str, post_text: str, replies: List[str]) -> None:
+    """
+    Keep up to VARIANT_POOL_SIZE distinct replies for a cached key. At
+    VARIANT_MAX_POOLS, the least requested pool makes way if the key is
+    hotter; its count is reset, so it has to get hot again to come back.
+    """
+    cache_key = generate_cache_key(platform, post_text)
+    if cache_key not in cache:
+        return
+    unique = list(dict.fromkeys(reply for reply in replies if reply))[:VARIANT_POOL_SIZE]
+    if len(unique) < 2:
+        return
+    if cache_key not in variant_pools and not _admits(cache_key):
+        # Pools got hotter while this one was being sampled
+        increment("variant_pools_rejected")
+        return
+
+    # The original reply has already been served; start with the first alternative
+    variant_pools[cache_key] = {"replies": unique, "next": 1}
+    increment("variant_pools_filled")
+    while len(variant_pools) > VARIANT_MAX_POOLS:
+        coldest = min((key for key in variant_pools if key != cache_key), key=lambda key: request_counts.get(key, 0))
+        del variant_pools[coldest]
+        request_counts.pop(coldest, None)
+        increment("variant_pools_evicted")
+    set_gauge("variant_pools", len(variant_pools))
+
 # Clean up expired cache entries periodically
 def cleanup_cache() -> None:
     """Remove expired entries from the cache"""
@@ -43,4 +136,14 @@ def cleanup_cache() -> None:
     ]
     
     for key in expired_keys:
-        del cache[key]
\ No newline at end of file
+        del cache[key]
+        variant_pools.pop(key, None)
+        request_counts.pop(key, None)
+
+    # Halve request counts so hotness reflects recent traffic, not all-time totals
+    for key, count in list(request_counts.items()):
+        if count > 1:
+            request_counts[key] = count // 2
+        else:
+            del request_counts[key]
+    set_gauge("variant_pools", len(variant_pools))
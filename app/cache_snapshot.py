@@ -0,0 +1,211 @@
+# On-disk snapshot of the in-memory reply cache, so a restart or deploy
+# doesn't start cold.
+#
+# File layout (little-endian), written to a temp file and renamed into place:
+#     header   16 bytes   magic (8s), entry count (u64)
+#     block    25 bytes   latest expires_at (f64), entries (u32), index bytes (u32),
+#                         data bytes (u32), encoding (u8: 0 raw, 1 zlib, 2 zstd)
+#              index      per entry: expires_at (f64), key length (u16),
+#                         value length (u32), then the UTF-8 key
+#              data       the block's values, concatenated and compressed together
+#
+# Values are compressed per block of BLOCK_ENTRIES rather than one by one,
+# which is several times cheaper for short replies. Keys and expiry times
+# stay uncompressed, so restore skips whole expired blocks without
+# decompressing them and skips expired entries without decoding them.
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Iterable, Optional, Tuple
+
+from app import cache as reply_cache
+from app.logs import get_logger
+from app.metrics import increment, observe, set_gauge
+
+# Snapshots are off unless a path is set
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "")
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", "300"))
+
+MAGIC = b"HLRCACH1"
+HEADER = struct.Struct("<8sQ")
+BLOCK = struct.Struct("<dIIIB")
+ENTRY = struct.Struct("<dHI")
+
+RAW, ZLIB, ZSTD = 0, 1, 2
+BLOCK_ENTRIES = 1024
+
+logger = get_logger("reply_cache")
+
+
+def _compressor():
+    try:
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress, ZSTD
+    except ImportError:
+        return (lambda data: zlib.compress(data, 1)), ZLIB
+
+
+def _decompressors():
+    decompress = {RAW: bytes, ZLIB: zlib.decompress}
+    try:
+        import zstandard
+        decompress[ZSTD] = zstandard.ZstdDecompressor().decompress
+    except ImportError:
+        pass
+    return decompress
+
+
+def _corruption_errors() -> tuple:
+    # KeyError: a block encoding this process can't decode (e.g. zstd without zstandard)
+    errors = (OSError, struct.error, zlib.error, UnicodeDecodeError, ValueError, KeyError)
+    try:
+        import zstandard
+        errors += (zstandard.ZstdError,)
+    except ImportError:
+        pass
+    return errors
+
+
+def write_snapshot(path: str, entries: Iterable[Tuple[str, Tuple[str, float]]]) -> int:
+    """
+    Write cache entries (`(key, (reply, cached_at))`) to `path` and return the
+    number written; expired entries are dropped. Touches neither the cache nor
+    metrics, so it is safe to run in a thread.
+    """
+    compress, encoding = _compressor()
+    expiry = reply_cache.CACHE_EXPIRY
+    now = time.time()
+    count = 0
+
+    index, values, latest = [], [], 0.0
+
+    def write_block(f):
+        raw = b"".join(values)
+        data, block_encoding = compress(raw), encoding
+        if len(data) >= len(raw):
+            data, block_encoding = raw, RAW
+        index_bytes = b"".join(index)
+        f.write(BLOCK.pack(latest, len(values), len(index_bytes), len(data), block_encoding))
+        f.write(index_bytes)
+        f.write(data)
+
+    # Per-process temp file: workers sharing a path must not write into the same one
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0))
+        for key, (reply, cached_at) in entries:
+            expires_at = cached_at + expiry
+            if expires_at <= now:
+                continue
+            key_bytes = key.encode()
+            value = reply.encode()
+            index.append(ENTRY.pack(expires_at, len(key_bytes), len(value)))
+            index.append(key_bytes)
+            values.append(value)
+            latest = max(latest, expires_at)
+            count += 1
+            if len(values) == BLOCK_ENTRIES:
+                write_block(f)
+                index, values, latest = [], [], 0.0
+        if values:
+            write_block(f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count))
+        # On disk before the rename, so a crash never leaves a partial file in place
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def record_snapshot(count: int, seconds: float) -> None:
+    """Report a finished snapshot; call from the event loop (metrics have one writer)"""
+    observe("cache_snapshot_seconds", seconds)
+    set_gauge("cache_snapshot_entries", count)
+
+
+def save_snapshot(path: str, entries: Optional[Iterable[Tuple[str, Tuple[str, float]]]] = None) -> int:
+    """Write `entries` (default: the live cache) to `path` and record metrics; returns the number written"""
+    start = time.perf_counter()
+    if entries is None:
+        entries = list(reply_cache.cache.items())
+    count = write_snapshot(path, entries)
+    record_snapshot(count, time.perf_counter() - start)
+    return count
+
+
+def load_snapshot(path: str, now: Optional[float] = None) -> Tuple[int, int]:
+    """
+    Restore entries from `path` that are unexpired at `now` (default: the
+    current time) into the cache, without replacing entries already in memory;
+    returns (restored, skipped_expired). A truncated or corrupt file is logged
+    and counted, and nothing from it is kept.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return 0, 0
+
+    start = time.perf_counter()
+    restored_keys = []
+    try:
+        skipped = _restore(path, time.time() if now is None else now, restored_keys)
+    except _corruption_errors() as e:
+        for key in restored_keys:
+            reply_cache.cache.pop(key, None)
+        logger.warning(f"Ignoring corrupt cache snapshot {path}: {e!r}")
+        increment("cache_restore_errors")
+        return 0, 0
+
+    observe("cache_restore_seconds", time.perf_counter() - start)
+    increment("cache_restored_entries", len(restored_keys))
+    increment("cache_restore_skipped_expired", skipped)
+    return len(restored_keys), skipped
+
+
+def _restore(path: str, now: float, restored_keys: list) -> int:
+    """Copy unexpired entries into the cache, appending their keys to `restored_keys`; returns the skipped count"""
+    decompress = _decompressors()
+    expiry = reply_cache.CACHE_EXPIRY
+    target = reply_cache.cache
+    skipped = 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, count = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            return 0
+        size = len(mm)
+        offset = HEADER.size
+        seen = 0
+        while offset < size:
+            latest, entries, index_length, data_length, encoding = BLOCK.unpack_from(mm, offset)
+            position = offset + BLOCK.size
+            data_start = position + index_length
+            offset = data_start + data_length
+            if offset > size:
+                raise ValueError("truncated block")
+            seen += entries
+            if latest <= now:
+                skipped += entries
+                continue
+
+            data = None
+            value_start = 0
+            for _ in range(entries):
+                expires_at, key_length, value_length = ENTRY.unpack_from(mm, position)
+                position += ENTRY.size
+                if expires_at <= now:
+                    skipped += 1
+                else:
+                    key = mm[position:position + key_length].decode()
+                    if key not in target:
+                        if data is None:
+                            data = decompress[encoding](mm[data_start:offset])
+                        target[key] = (data[value_start:value_start + value_length].decode(), expires_at - expiry)
+                        restored_keys.append(key)
+                position += key_length
+                value_start += value_length
+            if position != data_start or (data is not None and value_start != len(data)):
+                raise ValueError("block index doesn't match its data")
+        if seen != count:
+            raise ValueError(f"expected {count} entries, found {seen}")
+    return skipped
@@ -1,72 +1,198 @@
-import motor.motor_asyncio
+import hashlib
+import logging
 import os
-from bson import ObjectId
+import time
+import zlib
+from datetime import datetime
+from typing import List, Optional
+from app.logs import get_logger
+from app.profiling import record_stage
 
 MONGO_DETAILS = os.getenv("MONGO_URI")
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
-database = client.social_reply_db4
 
-# Schema validation for write operations
-async def setup_schema_validation():
-    await database.command({
-    "collMod": "replies",
-    "validator": {
-        "$jsonSchema": {
-            "bsonType": "object",
-            "required": ["platform", "post_text", "generated_reply", "timestamp"],
-            "properties": {
-                "platform": {
-                    "bsonType": "string",
-                    "enum": ["twitter", "linkedin", "instagram"],
-                    "description": "must be a valid platform"
-                },
-                "post_text": {
-                    "bsonType": "string",
-                    "minLength": 1,
-                    "description": "must be a non-empty string"
-                },
-                "generated_reply": {
-                    "bsonType": "string",
-                    "minLength": 1,
-                    "description": "must be a non-empty string"
-                },
-                "timestamp": {
-                    "bsonType": "date",
-                    "description": "must be a valid date"
-                }
+logger = get_logger("reply_db")
+
+# Created on first use so importing this module doesn't pull in Motor or touch the network
+_client = None
+_database = None
+
+def get_database():
+    """Return the shared database handle, creating the Motor client on first use"""
+    global _client, _database
+    if _database is None:
+        import motor.motor_asyncio
+
+        _client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+        _database = _client.social_reply_db4
+    return _database
+
+def __getattr__(name):
+    # Keep `app.db.client` / `app.db.database` available for scripts and tests
+    if name == "database":
+        return get_database()
+    if name == "client":
+        get_database()
+        return _client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Posts are stored once in `posts`, keyed by a hash of their text; replies
+# reference them by `post_id`. Older replies may still carry `post_text` inline.
+POST_COMPRESS_THRESHOLD = int(os.getenv("POST_COMPRESS_THRESHOLD", "1024"))  # bytes
+
+# Validator for `replies`: each reply references its post by `post_id` or,
+# before migration (scripts/migrate_posts.py), carries `post_text` inline
+REPLIES_VALIDATOR = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["platform", "generated_reply", "timestamp"],
+        "anyOf": [{"required": ["post_id"]}, {"required": ["post_text"]}],
+        "properties": {
+            "platform": {
+                "bsonType": "string",
+                "enum": ["twitter", "linkedin", "instagram"],
+                "description": "must be a valid platform"
+            },
+            "post_id": {
+                "bsonType": "string",
+                "minLength": 64,
+                "maxLength": 64,
+                "description": "must be the SHA-256 hex digest of the post text"
+            },
+            "post_text": {
+                "bsonType": "string",
+                "minLength": 1,
+                "description": "must be a non-empty string"
+            },
+            "generated_reply": {
+                "bsonType": "string",
+                "minLength": 1,
+                "description": "must be a non-empty string"
+            },
+            "timestamp": {
+                "bsonType": "date",
+                "description": "must be a valid date"
             }
         }
-    }})
+    }
+}
 
-# Update your save_reply function with better error handling and debugging
-async def save_reply(reply_data):
-    """
-    Save a reply record to the MongoDB database
-    """
-    # Create a new dictionary to avoid modifying the original
-    db_record = reply_data.copy()
+# Schema validation for write operations
+async def setup_schema_validation():
+    await get_database().command({"collMod": "replies", "validator": REPLIES_VALIDATOR})
+
+def post_id_for(post_text: str) -> str:
+    """Content hash used as the `posts` key"""
+    return hashlib.sha256(post_text.encode()).hexdigest()
+
+def encode_post(post_text: str) -> dict:
+    """Build a `posts` document, compressing the text above POST_COMPRESS_THRESHOLD"""
+    raw = post_text.encode()
+    doc = {"_id": post_id_for(post_text), "length": len(raw)}
+    if len(raw) <= POST_COMPRESS_THRESHOLD:
+        doc["text"] = post_text
+        return doc
+
+    try:
+        import zstandard
+        doc["data"], doc["encoding"] = zstandard.ZstdCompressor().compress(raw), "zstd"
+    except ImportError:
+        doc["data"], doc["encoding"] = zlib.compress(raw), "zlib"
+    return doc
+
+def decode_post(doc: dict) -> str:
+    """Recover the post text from a `posts` document"""
+    if "text" in doc:
+        return doc["text"]
+    if doc["encoding"] == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(doc["data"]).decode()
+    return zlib.decompress(doc["data"]).decode()
+
+async def save_post(post_text: str) -> str:
+    """Store the post text once and return its id"""
+    doc = encode_post(post_text)
+    post_id = doc.pop("_id")
+    await get_database().posts.update_one({"_id": post_id}, {"$setOnInsert": doc}, upsert=True)
+    return post_id
+
+def _prepare_reply(reply_data: dict, post_id: str) -> dict:
+    """Slim `replies` document: the post is referenced, not copied"""
+    db_record = {key: value for key, value in reply_data.items() if key != "post_text"}
+    db_record["post_id"] = post_id
     
-    # Ensure timestamp is a datetime object (MongoDB requires this)
+    # Ensure timestamp is a datetime object (MongoDB requires this).
+    # The API passes a datetime already; only string timestamps need parsing.
     if isinstance(db_record["timestamp"], str):
-        from datetime import datetime
         db_record["timestamp"] = datetime.fromisoformat(db_record["timestamp"].replace('Z', '+00:00'))
     
     # Make sure platform is acceptable according to schema
     if db_record["platform"].lower() not in ["twitter", "linkedin", "instagram"]:
         db_record["platform"] = "twitter"  # Default fallback
-    
-    # Debug print - keep this for now
-    print(f"⏳ Attempting to save to database: {db_record}")
-    
+    return db_record
+
+async def save_reply(reply_data):
+    """
+    Save a reply record to the MongoDB database
+    """
     # Insert the document
+    start = time.perf_counter()
     try:
-        # Remove the with_options() call that's causing the error
-        result = await database.replies.insert_one(db_record)
-        
-        print(f"✅ Document saved successfully with ID: {result.inserted_id}")
-        return str(result.inserted_id)
+        post_id = await save_post(reply_data["post_text"])
+        db_record = _prepare_reply(reply_data, post_id)
+        result = await get_database().replies.insert_one(db_record)
     except Exception as e:
         error_msg = f"Database insert failed: {str(e)}"
-        print(f"❌ ERROR: {error_msg}")
+        logger.error(error_msg, extra={"fields": {"platform": reply_data["platform"]}})
         # Add more context to the error
         raise Exception(error_msg) from e
+    finally:
+        record_stage("db_save", time.perf_counter() - start)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Reply saved", extra={"fields": {
+            "id": result.inserted_id,
+            "platform": db_record["platform"],
+            "post_id": post_id[:12],
+            "reply_chars": len(db_record["generated_reply"]),
+        }})
+    return str(result.inserted_id)
+
+async def save_replies(replies: List[dict]) -> List[str]:
+    """
+    Save several replies with one `insert_many`; each distinct post is stored once
+    """
+    start = time.perf_counter()
+    try:
+        post_ids = {}
+        for reply_data in replies:
+            if reply_data["post_text"] not in post_ids:
+                post_ids[reply_data["post_text"]] = await save_post(reply_data["post_text"])
+        db_records = [_prepare_reply(reply_data, post_ids[reply_data["post_text"]]) for reply_data in replies]
+        result = await get_database().replies.insert_many(db_records)
+    except Exception as e:
+        error_msg = f"Database insert failed: {str(e)}"
+        logger.error(error_msg, extra={"fields": {"replies": len(replies)}})
+        raise Exception(error_msg) from e
+    finally:
+        record_stage("db_save", time.perf_counter() - start)
+
+    return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+async def get_replies(query: Optional[dict] = None, limit: int = 50) -> List[dict]:
+    """
+    Fetch replies, newest first, with `post_text` filled in. All referenced
+    posts are loaded with a single batched lookup.
+    """
+    database = get_database()
+    replies = await database.replies.find(query or {}).sort("timestamp", -1).limit(limit).to_list(length=limit)
+
+    post_ids = list({reply["post_id"] for reply in replies if "post_text" not in reply and "post_id" in reply})
+    posts = {}
+    if post_ids:
+        async for doc in database.posts.find({"_id": {"$in": post_ids}}):
+            posts[doc["_id"]] = decode_post(doc)
+
+    for reply in replies:
+        if "post_text" not in reply:
+            reply["post_text"] = posts.get(reply.get("post_id"), "")
+    return replies
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from app.metrics import increment
+
+# End-to-end budget per platform (seconds) when the client doesn't send X-Request-Timeout
+PLATFORM_DEADLINES = {
+    "twitter": float(os.getenv("TWITTER_DEADLINE", "20")),
+    "instagram": float(os.getenv("INSTAGRAM_DEADLINE", "20")),
+    "linkedin": float(os.getenv("LINKEDIN_DEADLINE", "30")),
+}
+DEFAULT_DEADLINE = float(os.getenv("DEFAULT_DEADLINE", "30"))
+
+# Least time worth spending on a stage; below this it is skipped
+STAGE_MIN_BUDGET = {
+    "analyze": float(os.getenv("ANALYZE_MIN_BUDGET", "1.5")),
+    "personalize": float(os.getenv("PERSONALIZE_MIN_BUDGET", "2.0")),
+    "refine": float(os.getenv("REFINE_MIN_BUDGET", "1.5")),
+}
+
+# How often to check whether the client has gone away
+DISCONNECT_POLL_INTERVAL = 0.25
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a required stage can't finish within the request deadline"""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away and the work for it was cancelled"""
+
+
+class Deadline:
+    """Absolute point in time by which a request must be answered"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_request(cls, platform: str, timeout: Optional[float] = None) -> "Deadline":
+        """Use the client's timeout if it sent one, else the platform default"""
+        if timeout is None or timeout <= 0:
+            timeout = PLATFORM_DEADLINES.get(platform.lower(), DEFAULT_DEADLINE)
+        return cls(timeout)
+
+    @classmethod
+    def for_platforms(cls, platforms, timeout: Optional[float] = None) -> "Deadline":
+        """One deadline for several platforms: the client's timeout, else the longest default"""
+        return max((cls.for_request(platform, timeout) for platform in platforms), key=lambda d: d.seconds)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def allows(self, stage: str, reserve: float = 0.0) -> bool:
+        """Whether `stage` still fits after keeping `reserve` seconds for later stages"""
+        return self.remaining() - reserve >= STAGE_MIN_BUDGET[stage]
+
+
+async def cancel_on_disconnect(request, coro):
+    """
+    Run `coro` while polling `request.is_disconnected()`; if the client goes
+    away first, cancel the work and raise ClientDisconnected.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                increment("client_disconnects")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected("client disconnected before the reply was ready")
+    finally:
+        if not task.done():
+            task.cancel()
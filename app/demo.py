@@ -2,15 +2,21 @@ import streamlit as st
 import sys
 import os
 import asyncio
-import time
-from concurrent.futures import ThreadPoolExecutor
+import html
+import json
+import queue
+import threading
+
+import httpx
 
 # Add project root to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.ai import generate_reply
-from datetime import datetime
-from app.cache import get_cached_reply, cache_reply
+from app.transport import get_async_client
+
+# The demo is a thin client of the API so it shares the server's cache, scheduler and metrics
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+REQUEST_TIMEOUT = float(os.getenv("DEMO_REQUEST_TIMEOUT", "60"))
 
 st.set_page_config(
     page_title="Social Media Reply Generator",
@@ -18,32 +24,81 @@ st.set_page_config(
     layout="centered"
 )
 
-# Function with retry logic for rate limits
-async def generate_with_retry(platform, post_text, max_retries=3):
-    """Generate reply with automatic retry for rate limit errors"""
-    # First check if we have a cached response
-    cached_reply = get_cached_reply(platform, post_text)
-    if cached_reply:
-        return cached_reply, True  # Second value indicates it's from cache
-    
-    # No cache, try to generate with retries
-    retries = 0
-    while retries <= max_retries:
+class DemoBackend:
+    """
+    One event loop on a background thread plus its pooled HTTP client, shared
+    by every Streamlit session for the life of the process.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="demo-event-loop", daemon=True)
+        self.thread.start()
+        self.client = asyncio.run_coroutine_threadsafe(self._create_client(), self.loop).result()
+
+    async def _create_client(self) -> httpx.AsyncClient:
+        # Pooled per event loop by app.transport; this loop is the demo's own
+        return get_async_client("api", base_url=API_URL, timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=5.0))
+
+    def stream_reply(self, platform: str, post_text: str) -> "queue.Queue":
+        """Start streaming a reply on the background loop; events arrive on the returned queue"""
+        events: "queue.Queue" = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._stream(platform, post_text, events), self.loop)
+        return events
+
+    async def _stream(self, platform: str, post_text: str, events: "queue.Queue", max_retries: int = 3):
+        """Read /reply/stream, retrying with backoff when the server is rate limited"""
         try:
-            reply = await generate_reply(platform, post_text)
-            # Cache the successful response
-            cache_reply(platform, post_text, reply)
-            return reply, False  # Not from cache
+            for retries in range(max_retries + 1):
+                async with self.client.stream(
+                    "POST", "/reply/stream",
+                    json={"platform": platform, "post_text": post_text},
+                    headers={"X-Priority": "interactive", "X-Tenant-ID": "streamlit-demo"}
+                ) as response:
+                    if response.status_code == 429 and retries < max_retries:
+                        wait_time = 2 ** retries + 1  # 2, 3, 5 seconds
+                        events.put({"event": "retry", "data": wait_time})
+                        await asyncio.sleep(wait_time)
+                        continue
+                    if response.status_code != 200:
+                        await response.aread()
+                        events.put({"event": "error", "data": {"status": response.status_code, "detail": response.text}})
+                        return
+
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        # The stream has already answered 200; rejections arrive as error events
+                        error = event.get("data") if event["event"] == "error" else None
+                        if error and error.get("status") == 429 and retries < max_retries:
+                            break
+                        events.put(event)
+                    else:
+                        return
+
+                wait_time = 2 ** retries + 1
+                events.put({"event": "retry", "data": wait_time})
+                await asyncio.sleep(wait_time)
         except Exception as e:
-            if "429" in str(e) and retries < max_retries:
-                # Rate limit hit - wait with exponential backoff
-                wait_time = 2 ** retries + 1  # 1, 3, 7 seconds
-                with st.status(f"Rate limit reached. Waiting {wait_time}s and trying again..."):
-                    time.sleep(wait_time)
-                retries += 1
-            else:
-                # Either not a rate limit or we've exhausted retries
-                raise
+            events.put({"event": "error", "data": {"status": None, "detail": str(e)}})
+        finally:
+            events.put(None)
+
+@st.cache_resource
+def get_backend() -> DemoBackend:
+    return DemoBackend()
+
+def render_reply(placeholder, text: str) -> None:
+    placeholder.markdown(f"""<div style='
+        background-color: #f0f2f6;
+        padding: 15px;
+        border-radius: 10px;
+        color: #333333;
+        font-size: 16px;
+        line-height: 1.5;
+        border: 1px solid #e0e0e0;
+    '>{html.escape(text)}</div>""", unsafe_allow_html=True)
 
 st.title("💬 Social Media Reply Generator")
 st.subheader("Generate human-like replies to social media posts")
@@ -54,51 +109,42 @@ with st.form("reply_form"):
         ["linkedin", "twitter", "instagram"],
         help="Choose the social media platform"
     )
-    
+
     post_text = st.text_area(
         "Enter the social media post",
         height=150,
         help="Paste or type the post you want to reply to"
     )
-    
+
     submitted = st.form_submit_button("Generate Reply")
 
 if submitted and post_text:
-    with st.spinner("Generating human-like reply..."):
-        try:
-            # Use our retry function with ThreadPoolExecutor
-            with ThreadPoolExecutor() as executor:
-                def run_async_generate():
-                    return asyncio.run(generate_with_retry(platform, post_text))
-                
-                future = executor.submit(run_async_generate)
-                reply, from_cache = future.result()
-            
-            if from_cache:
-                st.success("Reply retrieved from cache!")
-            else:
-                st.success("Reply generated successfully!")
-            
-            st.markdown("### Generated Reply:")
-            st.markdown(f"""<div style='
-                background-color: #f0f2f6;
-                padding: 15px;
-                border-radius: 10px;
-                color: #333333;
-                font-size: 16px;
-                line-height: 1.5;
-                border: 1px solid #e0e0e0;
-            '>{reply}</div>""", unsafe_allow_html=True)
-            
-            # Display platform-specific emoji
-            platform_emoji = {"linkedin": "💼", "twitter": "🐦", "instagram": "📸"}
-            
-            st.markdown(f"**Platform:** {platform_emoji.get(platform, '🌐')} {platform.capitalize()}")
-            
-            
-            
-        except Exception as e:
-            st.error(f"Error generating reply: {str(e)}")
+    status = st.status("Generating human-like reply...", expanded=True)
+    st.markdown("### Generated Reply:")
+    reply_placeholder = st.empty()
+
+    events = get_backend().stream_reply(platform, post_text)
+    while (event := events.get()) is not None:
+        kind, data = event["event"], event["data"]
+        if kind == "retry":
+            status.update(label=f"Rate limit reached. Waiting {data}s and trying again...")
+        elif kind == "analysis":
+            status.write(f"Analyzed post: tone **{data.get('tone', 'neutral')}**, intent **{data.get('intent', 'sharing')}**")
+        elif kind == "draft":
+            status.write("Draft ready, refining...")
+            render_reply(reply_placeholder, data)
+        elif kind == "reply":
+            render_reply(reply_placeholder, data["generated_reply"])
+            label = "Reply retrieved from cache!" if data["cached"] else "Reply generated successfully!"
+            status.update(label=label, state="complete", expanded=False)
+        elif kind == "error":
+            status.update(label="Generation failed", state="error")
+            st.error(f"Error generating reply: {data['detail']}")
+
+    # Display platform-specific emoji
+    platform_emoji = {"linkedin": "💼", "twitter": "🐦", "instagram": "📸"}
+
+    st.markdown(f"**Platform:** {platform_emoji.get(platform, '🌐')} {platform.capitalize()}")
 
 st.markdown("---")
 st.markdown("### How it works")
@@ -109,4 +155,4 @@ This tool uses a sophisticated AI approach to generate authentic-sounding replie
 2. **Platform Adaptation**: Tailors the reply style to each platform's unique culture
 3. **Human-Like Generation**: Creates responses that avoid common AI patterns
 4. **Quality Assurance**: Ensures replies are engaging and relevant
-""")
\ No newline at end of file
+""")
@@ -0,0 +1,345 @@
+import asyncio
+import ipaddress
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional, Tuple
+
+from app.db import get_database
+from app.logs import get_logger
+from app.metrics import increment, observe, set_gauge
+from app.transport import get_async_client
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# A claimed job is owned by its worker until the lease ends; generation is
+# given a deadline inside the lease, so a live worker never loses its job
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))  # doubled on each retry
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_STATS_INTERVAL = float(os.getenv("JOB_STATS_INTERVAL", "15"))
+# Finished (done or failed) jobs are deleted by a TTL index this long after finishing
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+CALLBACK_ATTEMPTS = 3
+# Callbacks to loopback, private and link-local addresses are refused unless
+# this is set, so jobs can't make the server call internal services
+CALLBACK_ALLOW_PRIVATE = os.getenv("JOB_CALLBACK_ALLOW_PRIVATE", "false").lower() in ("1", "true", "yes")
+
+logger = get_logger("reply_jobs")
+
+# Takes a claimed job document and returns (generated_reply, timestamp)
+JobHandler = Callable[[dict], Awaitable[Tuple[str, datetime]]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _utc(value: datetime) -> datetime:
+    # Motor returns naive UTC datetimes unless the client is tz-aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_host(host: str) -> None:
+    """Raise ValueError for hosts callbacks must not reach; names are only checked when resolved"""
+    if CALLBACK_ALLOW_PRIVATE:
+        return
+    host = host.strip("[]").rstrip(".").lower()
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError("callback_url must not point to a loopback host")
+    try:
+        public = _is_public_address(host)
+    except ValueError:
+        return
+    if not public:
+        raise ValueError("callback_url must not point to a private or loopback address")
+
+
+async def _check_resolved_host(host: str, port: int) -> None:
+    """Refuse hostnames that resolve to a private or loopback address"""
+    check_callback_host(host)
+    if CALLBACK_ALLOW_PRIVATE:
+        return
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    if not all(_is_public_address(info[4][0]) for info in infos):
+        raise ValueError(f"callback host {host} resolves to a private or loopback address")
+
+
+def _jobs():
+    return get_database().jobs
+
+
+async def ensure_job_indexes() -> None:
+    """
+    Create the indexes behind the workers' claim query and the depth gauges,
+    plus a TTL index that removes finished jobs; idempotent, run at startup
+    """
+    jobs = _jobs()
+    try:
+        await jobs.create_index([("status", 1), ("available_at", 1)])
+        await jobs.create_index("lease_until")
+        # Only finished jobs have `finished_at`, so queued and running ones never expire
+        await jobs.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+    except Exception as e:
+        logger.warning(f"Failed to create job indexes: {e}")
+
+
+async def submit_job(platform: str, post_text: str, callback_url: Optional[str] = None,
+                     priority: Optional[str] = None, tenant: Optional[str] = None) -> str:
+    """Queue a generation job and return its id"""
+    now = _now()
+    job_id = uuid.uuid4().hex
+    await _jobs().insert_one({
+        "_id": job_id,
+        "status": "queued",
+        "platform": platform,
+        "post_text": post_text,
+        "callback_url": callback_url,
+        "priority": priority,
+        "tenant": tenant,
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now,
+        "updated_at": now
+    })
+    increment("jobs_submitted")
+    return job_id
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    return await _jobs().find_one({"_id": job_id})
+
+
+async def claim_job(worker_id: str) -> Optional[dict]:
+    """
+    Atomically take the oldest runnable job: queued and due, or running with
+    an expired lease and attempts left
+    """
+    from pymongo import ReturnDocument
+
+    now = _now()
+    return await _jobs().find_one_and_update(
+        {"$or": [
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"status": "running", "lease_until": {"$lt": now}, "attempts": {"$lt": JOB_MAX_ATTEMPTS}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker_id,
+                # Fences this claim's updates; worker ids repeat across hosts (same pid)
+                "lease": uuid.uuid4().hex,
+                "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def fail_abandoned_job() -> Optional[dict]:
+    """
+    Mark one job failed whose lease expired on its last attempt, e.g. a post
+    that crashes or hangs every worker that takes it; returns the updated job
+    """
+    from pymongo import ReturnDocument
+
+    now = _now()
+    return await _jobs().find_one_and_update(
+        {"status": "running", "lease_until": {"$lt": now}, "attempts": {"$gte": JOB_MAX_ATTEMPTS}},
+        {
+            "$set": {"status": "failed", "error": "lease expired on the final attempt",
+                     "updated_at": now, "finished_at": now},
+            "$unset": {"lease_until": ""}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+
+
+class JobWorkers:
+    """Pool of background tasks that claim jobs from MongoDB and run them through `handler`"""
+
+    def __init__(self, handler: JobHandler, workers: int = JOB_WORKERS):
+        self.handler = handler
+        self.workers = workers
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+        self.tasks = []
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self.tasks = [asyncio.create_task(self._run(f"{os.getpid()}-{i}")) for i in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._report()))
+        set_gauge("job_workers", self.workers)
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _run(self, worker_id: str) -> None:
+        while True:
+            try:
+                if not await self.process_next(worker_id):
+                    await asyncio.sleep(JOB_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} failed to poll: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def process_next(self, worker_id: str) -> bool:
+        """Claim and run one job; returns False when nothing was runnable"""
+        job = await claim_job(worker_id)
+        if job is None:
+            return False
+
+        observe("job_queue_lag_seconds", (_now() - _utc(job["available_at"])).total_seconds())
+        self.busy += 1
+        set_gauge("job_workers_busy", self.busy)
+        start = time.monotonic()
+        try:
+            await self._process(job)
+        finally:
+            self.busy -= 1
+            self.busy_seconds += time.monotonic() - start
+            set_gauge("job_workers_busy", self.busy)
+            self._report_utilization()
+        return True
+
+    async def _process(self, job: dict) -> None:
+        try:
+            generated_reply, timestamp = await self.handler(job)
+        except Exception as e:
+            await self._fail(job, e)
+            return
+
+        now = _now()
+        update = {
+            "status": "done",
+            "generated_reply": generated_reply,
+            "timestamp": timestamp,
+            "updated_at": now,
+            "finished_at": now
+        }
+        if not await self._finish(job, {"$set": update, "$unset": {"lease_until": "", "error": ""}}):
+            return
+        increment("jobs_completed")
+        observe("job_total_seconds", (_now() - _utc(job["created_at"])).total_seconds())
+        await self._callback(dict(job, **update))
+
+    async def _fail(self, job: dict, error: Exception) -> None:
+        now = _now()
+        if job["attempts"] < JOB_MAX_ATTEMPTS:
+            delay = JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+            if await self._finish(job, {
+                "$set": {"status": "queued", "available_at": now + timedelta(seconds=delay),
+                         "error": str(error), "updated_at": now},
+                "$unset": {"lease_until": ""}
+            }):
+                increment("jobs_retried")
+            return
+
+        update = {"status": "failed", "error": str(error), "updated_at": now, "finished_at": now}
+        if not await self._finish(job, {"$set": update, "$unset": {"lease_until": ""}}):
+            return
+        increment("jobs_failed")
+        await self._callback(dict(job, **update))
+
+    async def _finish(self, job: dict, update: dict) -> bool:
+        """
+        Apply `update` only if this claim still holds the job. A worker that
+        stalled past its lease may have lost the job to another claim, whose
+        outcome must not be overwritten; returns False and drops the result then.
+        """
+        result = await _jobs().update_one(
+            {"_id": job["_id"], "lease": job["lease"], "status": "running"}, update
+        )
+        if result.matched_count:
+            return True
+        logger.warning(f"Worker {job['worker']} lost the lease on job {job['_id']}; dropping its result")
+        increment("jobs_lease_lost")
+        return False
+
+    async def _callback(self, job: dict) -> None:
+        """POST the final job state to its callback URL, if it registered one"""
+        url = job.get("callback_url")
+        if not url:
+            return
+
+        import httpx
+        # Redirects could lead a checked URL to an internal address
+        http = get_async_client("callbacks", timeout=CALLBACK_TIMEOUT, follow_redirects=False)
+
+        payload = job_status(job)
+        for attempt in range(CALLBACK_ATTEMPTS):
+            try:
+                target = httpx.URL(url)
+                await _check_resolved_host(target.host, target.port or (443 if target.scheme == "https" else 80))
+                response = await http.post(target, json=payload)
+                if response.status_code < 500:
+                    increment("job_callbacks_sent")
+                    return
+            except (httpx.InvalidURL, ValueError) as e:
+                logger.warning(f"Refused callback for job {job['_id']}: {e}")
+                increment("job_callbacks_refused")
+                return
+            except (httpx.HTTPError, OSError) as e:
+                logger.warning(f"Callback for job {job['_id']} failed: {e}")
+            if attempt < CALLBACK_ATTEMPTS - 1:
+                await asyncio.sleep(2 ** attempt)
+        increment("job_callbacks_failed")
+
+    def _report_utilization(self) -> None:
+        elapsed = (time.monotonic() - self.started_at) * self.workers
+        if elapsed > 0:
+            set_gauge("job_worker_utilization", round(min(self.busy_seconds / elapsed, 1.0), 4))
+
+    async def fail_abandoned(self) -> int:
+        """Fail every job that has run out of attempts on expired leases; returns how many"""
+        failed = 0
+        while (job := await fail_abandoned_job()) is not None:
+            failed += 1
+            increment("jobs_failed")
+            increment("jobs_abandoned")
+            await self._callback(job)
+        return failed
+
+    async def _report(self) -> None:
+        """Fail abandoned jobs and refresh queue depth and utilization gauges"""
+        while True:
+            try:
+                await self.fail_abandoned()
+                for status in ("queued", "running"):
+                    set_gauge(f"jobs_{status}", await _jobs().count_documents({"status": status}))
+            except Exception as e:
+                logger.warning(f"Failed to count jobs: {e}")
+            self._report_utilization()
+            await asyncio.sleep(JOB_STATS_INTERVAL)
+
+
+def job_status(job: dict) -> dict:
+    """Public view of a job document"""
+    timestamp = job.get("timestamp")
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "platform": job["platform"],
+        "attempts": job.get("attempts", 0),
+        "generated_reply": job.get("generated_reply"),
+        "timestamp": _utc(timestamp).isoformat() if timestamp else None,
+        "error": job.get("error")
+    }
@@ -0,0 +1,97 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_FILE = os.getenv("LOG_FILE", "metrics.log")
+
+_log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Format records as `message key=value ...` using the `fields` extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Let through a fraction of records below WARNING; warnings and errors always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that starts the writer thread when the first record is emitted"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if _listener is None:
+            setup_logging()
+        super().emit(record)
+
+
+def setup_logging() -> None:
+    """Open the log handlers and start the background thread that writes queued records"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = _start_listener()
+
+
+def _start_listener() -> logging.handlers.QueueListener:
+    formatter = KeyValueFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE, delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    listener = logging.handlers.QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+    return listener
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str, sample_rate: Optional[float] = None) -> logging.Logger:
+    """
+    Return a logger whose records are handed to a queue and written by a
+    background thread, so logging from the event loop never blocks on I/O.
+    Records below WARNING are sampled at `sample_rate` (LOG_SAMPLE_RATE by default).
+    """
+    logger = logging.getLogger(name)
+    if any(isinstance(h, LazyQueueHandler) for h in logger.handlers):
+        return logger
+
+    handler = LazyQueueHandler(_log_queue)
+    logger.addFilter(SamplingFilter(LOG_SAMPLE_RATE if sample_rate is None else sample_rate))
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
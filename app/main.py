@@ -1,21 +1,58 @@
-from fastapi import FastAPI, HTTPException
-from app.models import ReplyRequest, ReplyResponse
-from app.ai import generate_reply
-from app.db import save_reply, setup_schema_validation
-from app.cache import get_cached_reply, cache_reply, cleanup_cache
-from app.metrics import log_request, get_metrics_summary
+from fastapi import Depends, FastAPI, HTTPException, Header, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from app.models import ReplyRequest, ReplyResponse, FanOutRequest, FanOutResponse, JobRequest, JobStatus
+from app.ai import PERSONAS, generate_reply, generate_variants, fan_out_replies
+from app.db import save_reply, save_replies, get_replies, setup_schema_validation
+from app.cache import (
+    cache, get_cached_reply, cache_reply, cleanup_cache,
+    claim_variant_fill, release_variant_fill, store_variants, VARIANT_POOL_SIZE
+)
+from app.metrics import increment, log_request, get_metrics_summary
+from app.logs import setup_logging
+from app.scheduler import scheduler, AdmissionRejected
+from app.deadline import Deadline, DeadlineExceeded, ClientDisconnected, cancel_on_disconnect
+from app.profiling import SlowRequestMiddleware, ProfilerBusy, loop_monitor, sample_stacks, slow_requests, PROFILE_INTERVAL
+from app.transport import close_clients
+from app.cache_snapshot import (
+    CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_INTERVAL, load_snapshot, record_snapshot, save_snapshot, write_snapshot
+)
+from app.jobs import JobWorkers, JOB_WORKERS, JOB_LEASE_SECONDS, ensure_job_indexes, submit_job, get_job, job_status
+from typing import List, Optional
 from datetime import datetime, timezone
 from contextlib import asynccontextmanager
 import asyncio
+import hmac
+import json
+import os
 import time
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Open log handlers here rather than at import; the Mistral and Mongo
+    # clients are created on first use
+    setup_logging()
+    if CACHE_SNAPSHOT_PATH:
+        load_snapshot(CACHE_SNAPSHOT_PATH)
+        snapshot_task = asyncio.create_task(periodic_cache_snapshot())
     # Start cache cleanup task
     cleanup_task = asyncio.create_task(periodic_cache_cleanup())
+    # In the background: waiting on Mongo server selection would hold up cache-only traffic
+    index_task = asyncio.create_task(ensure_job_indexes())
+    job_workers = JobWorkers(run_job, JOB_WORKERS)
+    if JOB_WORKERS > 0:
+        job_workers.start()
+    loop_monitor.start()
     yield
-    # Cancel cleanup task on shutdown
+    # Cancel background tasks on shutdown
     cleanup_task.cancel()
+    index_task.cancel()
+    await job_workers.stop()
+    await loop_monitor.stop()
+    await close_clients()
+    if CACHE_SNAPSHOT_PATH:
+        snapshot_task.cancel()
+        await asyncio.gather(snapshot_task, return_exceptions=True)
+        save_snapshot(CACHE_SNAPSHOT_PATH)
 
 async def periodic_cache_cleanup():
     """Periodically clean up the cache"""
@@ -23,16 +60,36 @@ async def periodic_cache_cleanup():
         await asyncio.sleep(3600)  # Run every hour
         cleanup_cache()
 
+async def periodic_cache_snapshot():
+    """Periodically write the cache to CACHE_SNAPSHOT_PATH"""
+    while True:
+        await asyncio.sleep(CACHE_SNAPSHOT_INTERVAL)
+        # Copy on the loop, encode and write in a thread, record metrics back on the loop
+        start = time.perf_counter()
+        entries = list(cache.items())
+        count = await asyncio.to_thread(write_snapshot, CACHE_SNAPSHOT_PATH, entries)
+        record_snapshot(count, time.perf_counter() - start)
+
 app = FastAPI(
     title="Human-like Social Media Reply Generator",
     description="Generate authentic, human-like replies to social media posts using generative AI.",
     version="0.1.0",
     lifespan=lifespan
 )
+app.add_middleware(SlowRequestMiddleware)
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Only allow requests carrying the configured `X-Admin-Token`"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin access required")
 
 def normalize_platform(platform: str) -> str:
     """Normalize platform names to standard format"""
-    if platform.lower() == "insta":
+    platform = platform.strip().lower()
+    if platform == "insta":
         return "instagram"
     return platform
 
@@ -42,11 +99,77 @@ async def metrics_endpoint():
     """Get generation metrics and statistics"""
     return get_metrics_summary()
 
+async def generate_and_store(platform: str, post_text: str, deadline: Deadline,
+                             priority: Optional[str], tenant: Optional[str], on_stage=None):
+    """Generate, cache and persist a new reply; returns the reply and its timestamp"""
+    async with scheduler.slot(priority, tenant, deadline.remaining()):
+        generated_reply = await generate_reply(platform, post_text, deadline=deadline, on_stage=on_stage)
+    cache_reply(platform, post_text, generated_reply)
+
+    # Keep the datetime for MongoDB; only the response needs the ISO string
+    timestamp = datetime.now(timezone.utc)
+    await save_reply({
+        "platform": platform,
+        "post_text": post_text,
+        "generated_reply": generated_reply,
+        "timestamp": timestamp,
+        "cached": False
+    })
+    return generated_reply, timestamp
+
+async def fill_variant_pool(platform: str, post_text: str, reply: str):
+    """Background: sample alternatives to a hot cached reply at bulk priority"""
+    try:
+        async with scheduler.slot("bulk", "variant-pools"):
+            variants = await generate_variants(platform, reply, VARIANT_POOL_SIZE - 1)
+        store_variants(platform, post_text, [reply] + variants)
+    except Exception:
+        # Best effort: the key keeps serving its single cached reply
+        increment("variant_pool_fill_errors")
+    finally:
+        release_variant_fill(platform, post_text)
+
+# Running pool fills; the event loop only keeps weak references to tasks
+variant_fill_tasks = set()
+
+def maybe_fill_variants(platform: str, post_text: str, reply: str) -> None:
+    if claim_variant_fill(platform, post_text):
+        task = asyncio.create_task(fill_variant_pool(platform, post_text, reply))
+        variant_fill_tasks.add(task)
+        task.add_done_callback(variant_fill_tasks.discard)
+
+@app.get("/replies", response_model=List[ReplyResponse], tags=["Reply Generation"])
+async def list_replies_endpoint(platform: Optional[str] = None, limit: int = Query(20, ge=1, le=200)):
+    """List stored replies, newest first, optionally filtered by platform"""
+    query = {"platform": normalize_platform(platform)} if platform else {}
+    replies = await get_replies(query, limit)
+    return [
+        ReplyResponse(
+            platform=reply["platform"],
+            post_text=reply["post_text"],
+            generated_reply=reply["generated_reply"],
+            timestamp=reply["timestamp"].isoformat()
+        )
+        for reply in replies
+    ]
+
 # Update your reply endpoint
 @app.post("/reply", response_model=ReplyResponse, tags=["Reply Generation"])
-async def reply_endpoint(request: ReplyRequest):
+async def reply_endpoint(
+    request: ReplyRequest,
+    http_request: Request,
+    x_priority: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None)
+):
     """
     Generate a human-like reply to a social media post and store the request/response in the database.
+
+    Cache misses go through the admission scheduler: `X-Priority` picks the class
+    (`interactive` or `bulk`) and `X-Tenant-ID` (or `X-API-Key`) the fair-queuing tenant.
+    `X-Request-Timeout` (seconds) overrides the per-platform deadline; generation
+    is cancelled if the client disconnects.
     """
     start_time = time.time()
     error = False
@@ -62,26 +185,26 @@ async def reply_endpoint(request: ReplyRequest):
         if cached_reply:
             # Using cached reply
             generated_reply = cached_reply
+            timestamp = datetime.now(timezone.utc)
             is_cached = True
+            maybe_fill_variants(platform, request.post_text, cached_reply)
         else:
-            # Generate new reply
-            generated_reply = await generate_reply(platform, request.post_text)
-            cache_reply(platform, request.post_text, generated_reply)
+            # Generate new reply, abandoning the work if the client goes away
+            deadline = Deadline.for_request(platform, x_request_timeout)
+            generated_reply, timestamp = await cancel_on_disconnect(
+                http_request,
+                generate_and_store(platform, request.post_text, deadline, x_priority, x_tenant_id or x_api_key)
+            )
             is_cached = False
         
-        timestamp = datetime.now(timezone.utc).isoformat()
         reply_record = {
             "platform": platform,
             "post_text": request.post_text,
             "generated_reply": generated_reply,
-            "timestamp": timestamp,
+            "timestamp": timestamp.isoformat(),
             "cached": is_cached
         }
-        
-        # Only save to DB if it's a new reply
-        if not is_cached:
-            await save_reply(reply_record)
-            
+
         end_time = time.time()
         # Log metrics (non-blocking)
         asyncio.create_task(log_request(
@@ -94,6 +217,12 @@ async def reply_endpoint(request: ReplyRequest):
         ))
             
         return ReplyResponse(**reply_record)
+    except AdmissionRejected as e:
+        # Shed load early; the scheduler counts rejections per class
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ClientDisconnected as e:
+        # Nobody is listening; counted as client_disconnects
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
         error = True
         end_time = time.time()
@@ -109,5 +238,243 @@ async def reply_endpoint(request: ReplyRequest):
             error=True
         ))
         
-        raise HTTPException(status_code=500, detail=str(e))
+        status_code = 504 if isinstance(e, DeadlineExceeded) else 500
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+@app.post("/reply/stream", tags=["Reply Generation"])
+async def reply_stream_endpoint(
+    request: ReplyRequest,
+    x_priority: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None)
+):
+    """
+    Same as `/reply`, but streams newline-delimited JSON events as stages finish:
+    `analysis`, `draft`, then a final `reply` (the ReplyResponse fields plus `cached`)
+    or `error` (`status` and `detail`). Closing the connection cancels generation.
+    """
+    platform = normalize_platform(request.platform)
+    post_text = request.post_text
+
+    async def produce(events: asyncio.Queue):
+        start_time = time.time()
+        generated_reply = ""
+        try:
+            cached_reply = get_cached_reply(platform, post_text)
+            if cached_reply:
+                generated_reply, timestamp, is_cached = cached_reply, datetime.now(timezone.utc), True
+                maybe_fill_variants(platform, post_text, cached_reply)
+            else:
+                deadline = Deadline.for_request(platform, x_request_timeout)
+                generated_reply, timestamp = await generate_and_store(
+                    platform, post_text, deadline, x_priority, x_tenant_id or x_api_key,
+                    on_stage=lambda stage, result: events.put_nowait({"event": stage, "data": result})
+                )
+                is_cached = False
+
+            events.put_nowait({"event": "reply", "data": {
+                "platform": platform,
+                "post_text": post_text,
+                "generated_reply": generated_reply,
+                "timestamp": timestamp.isoformat(),
+                "cached": is_cached
+            }})
+            asyncio.create_task(log_request(
+                platform=platform,
+                post_text=post_text,
+                cached=is_cached,
+                start_time=start_time,
+                end_time=time.time(),
+                reply_length=len(generated_reply)
+            ))
+        except AdmissionRejected as e:
+            events.put_nowait({"event": "error", "data": {"status": e.status_code, "detail": str(e)}})
+        except Exception as e:
+            asyncio.create_task(log_request(
+                platform=platform,
+                post_text=post_text,
+                cached=False,
+                start_time=start_time,
+                end_time=time.time(),
+                reply_length=len(generated_reply),
+                error=True
+            ))
+            status_code = 504 if isinstance(e, DeadlineExceeded) else 500
+            events.put_nowait({"event": "error", "data": {"status": status_code, "detail": str(e)}})
+        finally:
+            events.put_nowait(None)
+
+    async def stream():
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(produce(events))
+        try:
+            while (event := await events.get()) is not None:
+                yield json.dumps(event) + "\n"
+        finally:
+            # Starlette cancels this generator when the client disconnects
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def fan_out_and_store(platforms: List[str], post_text: str, deadline: Deadline,
+                            priority: Optional[str], tenant: Optional[str]):
+    """Generate replies for several platforms in one scheduler slot, cache each and store them in one write"""
+    async with scheduler.slot(priority, tenant, deadline.remaining()):
+        replies, savings = await fan_out_replies(platforms, post_text, deadline=deadline)
+    for platform, reply in replies.items():
+        cache_reply(platform, post_text, reply)
+
+    timestamp = datetime.now(timezone.utc)
+    await save_replies([
+        {
+            "platform": platform,
+            "post_text": post_text,
+            "generated_reply": reply,
+            "timestamp": timestamp,
+            "cached": False
+        }
+        for platform, reply in replies.items()
+    ])
+    return replies, savings, timestamp
+
+@app.post("/reply/fanout", response_model=FanOutResponse, tags=["Reply Generation"])
+async def fan_out_endpoint(
+    request: FanOutRequest,
+    http_request: Request,
+    x_priority: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None)
+):
+    """
+    Replies to one post for several platforms (all three by default). Cached
+    platforms are served from the cache; the rest share one analysis and one
+    completion. Takes the same headers as `/reply`, and the default deadline is
+    the longest of the platforms'. `calls_saved` and `tokens_saved` compare
+    against one `/reply` per generated platform.
+    """
+    start_time = time.time()
+    platforms = list(dict.fromkeys(normalize_platform(platform) for platform in request.platforms))
+    unknown = [platform for platform in platforms if platform not in PERSONAS]
+    if unknown:
+        raise HTTPException(
+            status_code=422, detail=f"Unsupported platforms: {', '.join(unknown)} (expected {', '.join(PERSONAS)})"
+        )
+    replies = {}
+    for platform in platforms:
+        cached_reply = get_cached_reply(platform, request.post_text)
+        if cached_reply:
+            replies[platform] = cached_reply
+    cached_platforms = list(replies)
+    missing = [platform for platform in platforms if platform not in replies]
+
+    try:
+        savings = {"calls_saved": 0, "tokens_saved": 0}
+        timestamp = datetime.now(timezone.utc)
+        if missing:
+            deadline = Deadline.for_platforms(missing, x_request_timeout)
+            generated, savings, timestamp = await cancel_on_disconnect(
+                http_request,
+                fan_out_and_store(missing, request.post_text, deadline, x_priority, x_tenant_id or x_api_key)
+            )
+            replies.update(generated)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ClientDisconnected as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    except Exception as e:
+        end_time = time.time()
+        for platform in missing:
+            asyncio.create_task(log_request(
+                platform=platform,
+                post_text=request.post_text,
+                cached=False,
+                start_time=start_time,
+                end_time=end_time,
+                reply_length=0,
+                error=True
+            ))
+        status_code = 504 if isinstance(e, DeadlineExceeded) else 500
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+    end_time = time.time()
+    for platform in platforms:
+        asyncio.create_task(log_request(
+            platform=platform,
+            post_text=request.post_text,
+            cached=platform in cached_platforms,
+            start_time=start_time,
+            end_time=end_time,
+            reply_length=len(replies[platform])
+        ))
+
+    return FanOutResponse(
+        post_text=request.post_text,
+        replies={platform: replies[platform] for platform in platforms},
+        cached_platforms=cached_platforms,
+        timestamp=timestamp.isoformat(),
+        **savings
+    )
+
+async def run_job(job: dict):
+    """Job handler: same cache, scheduler and storage path as /reply"""
+    cached_reply = get_cached_reply(job["platform"], job["post_text"])
+    if cached_reply:
+        return cached_reply, datetime.now(timezone.utc)
+    # Finish well inside the lease so another worker never picks the job up while it runs
+    deadline = Deadline(JOB_LEASE_SECONDS * 0.8)
+    return await generate_and_store(
+        job["platform"], job["post_text"], deadline, job.get("priority") or "bulk", job.get("tenant")
+    )
+
+@app.post("/jobs", response_model=JobStatus, status_code=202, tags=["Jobs"])
+async def submit_job_endpoint(
+    request: JobRequest,
+    x_priority: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Queue reply generation and return a job id immediately. Poll `GET /jobs/{job_id}`
+    or pass `callback_url` to be sent the final status. Jobs default to `bulk` priority.
+    """
+    platform = normalize_platform(request.platform)
+    job_id = await submit_job(
+        platform, request.post_text, str(request.callback_url) if request.callback_url else None,
+        priority=x_priority or "bulk", tenant=x_tenant_id or x_api_key
+    )
+    return JobStatus(job_id=job_id, status="queued", platform=platform, attempts=0)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus, tags=["Jobs"])
+async def get_job_endpoint(job_id: str):
+    """Current state of a job: queued, running, done or failed"""
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatus(**job_status(job))
+
+@app.get("/admin/profile", response_class=PlainTextResponse, tags=["Admin"], dependencies=[Depends(require_admin)])
+async def profile_endpoint(
+    seconds: float = Query(10, gt=0, le=60),
+    interval: float = Query(PROFILE_INTERVAL, ge=0.001, le=1)
+):
+    """
+    Sample this worker's thread stacks for `seconds` and return collapsed stacks
+    (one `frame;frame;... count` line per stack) for flamegraph.pl or speedscope.
+    """
+    try:
+        return await asyncio.to_thread(sample_stacks, seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/loop-lag", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def loop_lag_endpoint():
+    """How late this worker's event loop has been waking up"""
+    return loop_monitor.summary()
 
+@app.get("/admin/slow-requests", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def slow_requests_endpoint():
+    """Per-stage timings of the latest requests over SLOW_REQUEST_THRESHOLD, newest first"""
+    return list(reversed(slow_requests))
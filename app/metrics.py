@@ -1,56 +1,137 @@
 import time
+import bisect
 from datetime import datetime
 import json
 import os
-from typing import Dict, List, Any
+from typing import Dict, Any
 import asyncio
-import logging
+from app.logs import get_logger
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("metrics.log"),
-        logging.StreamHandler()
-    ]
-)
+# Handlers (stdout + metrics.log) are opened on the first record, not at import
+logger = get_logger("reply_metrics", sample_rate=1.0)
 
-logger = logging.getLogger("reply_metrics")
+# Set to share metrics between `uvicorn --workers N` processes; each worker
+# writes its own memory-mapped file there and /metrics sums them all.
+# Clear the directory before starting the server.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+_shared_file = None
 
-# In-memory metrics store
+# In-memory metrics store (single-process mode)
 metrics_store: Dict[str, Any] = {
-    "requests": 0,
-    "cache_hits": 0,
-    "generation_times": [],
-    "platform_counts": {"linkedin": 0, "twitter": 0, "instagram": 0},
-    "error_count": 0,
     "hourly_usage": {},
-    "avg_reply_length": 0,
-    "total_reply_length": 0
+    "counters": {},
+    "gauges": {},
+    "histograms": {}
 }
 
+# Upper bounds (seconds) for histogram buckets; the last bucket is +Inf
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PLATFORMS = ("linkedin", "twitter", "instagram")
+
+# Requests since metrics were last written to disk
+_unsaved_requests = 0
+
+def _shared():
+    """This process's shared metrics file, opened on first use (and again after a fork)"""
+    global _shared_file
+    if _shared_file is None or _shared_file.pid != os.getpid():
+        from app.shared_metrics import SharedMetricsFile
+        _shared_file = SharedMetricsFile(METRICS_MULTIPROC_DIR)
+    return _shared_file
+
+def increment(name: str, amount: float = 1) -> None:
+    """Add to a named counter"""
+    if METRICS_MULTIPROC_DIR:
+        _shared().add(f"c:{name}", amount)
+        return
+    counters = metrics_store["counters"]
+    counters[name] = counters.get(name, 0) + amount
+
+def set_gauge(name: str, value: float) -> None:
+    """Set a named gauge to its current value"""
+    if METRICS_MULTIPROC_DIR:
+        _shared().set(f"g:{name}", value)
+        return
+    metrics_store["gauges"][name] = value
+
+def observe(name: str, value: float) -> None:
+    """Record a value in a named histogram"""
+    bucket = bisect.bisect_left(HISTOGRAM_BUCKETS, value)
+    if METRICS_MULTIPROC_DIR:
+        shared = _shared()
+        shared.add(f"h:{name}:{bucket}", 1)
+        shared.add(f"h:{name}:sum", value)
+        shared.add(f"h:{name}:count", 1)
+        return
+    histogram = metrics_store["histograms"].get(name)
+    if histogram is None:
+        histogram = {"buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        metrics_store["histograms"][name] = histogram
+    histogram["buckets"][bucket] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+def collect() -> Dict[str, Any]:
+    """Current counters, gauges and histograms, summed across workers in multiprocess mode"""
+    if not METRICS_MULTIPROC_DIR:
+        return metrics_store
+
+    from app.shared_metrics import aggregate
+
+    collected = {"counters": {}, "gauges": {}, "histograms": {}}
+    for key, value in aggregate(METRICS_MULTIPROC_DIR).items():
+        kind, name = key[0], key[2:]
+        if kind == "c":
+            collected["counters"][name] = value
+        elif kind == "g":
+            collected["gauges"][name] = value
+        elif kind == "h":
+            name, field = name.rsplit(":", 1)
+            histogram = collected["histograms"].setdefault(
+                name, {"buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1), "sum": 0.0, "count": 0}
+            )
+            if field in ("sum", "count"):
+                histogram[field] = value
+            else:
+                histogram["buckets"][int(field)] = value
+    return collected
+
+def summarize_histogram(histogram: Dict[str, Any]) -> Dict[str, Any]:
+    """Cumulative bucket counts keyed by upper bound, plus count and mean"""
+    cumulative = {}
+    running = 0
+    for bound, count in zip(HISTOGRAM_BUCKETS + ("+Inf",), histogram["buckets"]):
+        running += count
+        cumulative[str(bound)] = int(running)
+    return {
+        "count": int(histogram["count"]),
+        "mean": round(histogram["sum"] / histogram["count"], 4) if histogram["count"] else 0,
+        "buckets": cumulative
+    }
+
 async def log_request(platform: str, post_text: str, cached: bool, start_time: float, end_time: float, 
                       reply_length: int, error: bool = False) -> None:
     """Log metrics for a request"""
+    global _unsaved_requests
     current_hour = datetime.now().strftime("%Y-%m-%d %H:00")
     generation_time = end_time - start_time
     
     # Update metrics
-    metrics_store["requests"] += 1
+    increment("requests")
     
     if cached:
-        metrics_store["cache_hits"] += 1
+        increment("cache_hits")
     
     if not error:
-        metrics_store["generation_times"].append(generation_time)
-        metrics_store["platform_counts"][platform] += 1
-        metrics_store["total_reply_length"] += reply_length
-        metrics_store["avg_reply_length"] = metrics_store["total_reply_length"] / (metrics_store["requests"] - metrics_store["error_count"])
+        observe("generation_seconds", generation_time)
+        if platform in PLATFORMS:
+            increment(f"platform_{platform}")
+        increment("total_reply_length", reply_length)
     else:
-        metrics_store["error_count"] += 1
+        increment("errors")
     
-    # Update hourly usage
+    # Update hourly usage (kept per process)
     if current_hour not in metrics_store["hourly_usage"]:
         metrics_store["hourly_usage"][current_hour] = 0
     metrics_store["hourly_usage"][current_hour] += 1
@@ -62,28 +143,45 @@ async def log_request(platform: str, post_text: str, cached: bool, start_time: f
     )
     
     # Periodically save metrics to disk
-    if metrics_store["requests"] % 10 == 0:
+    _unsaved_requests += 1
+    if _unsaved_requests >= 10:
+        _unsaved_requests = 0
         await save_metrics()
 
 async def save_metrics() -> None:
     """Save metrics to disk"""
     try:
-        with open("reply_metrics.json", "w") as f:
-            json.dump(metrics_store, f, indent=2)
+        # Every worker writes the same aggregated view; replace atomically so readers never see a partial file
+        data = dict(get_metrics_summary(), hourly_usage=metrics_store["hourly_usage"])
+        tmp_path = f"reply_metrics.json.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, "reply_metrics.json")
     except Exception as e:
         logger.error(f"Failed to save metrics: {e}")
 
 def get_metrics_summary() -> Dict[str, Any]:
     """Get a summary of current metrics"""
-    total_requests = metrics_store["requests"]
-    cache_hit_rate = (metrics_store["cache_hits"] / total_requests) * 100 if total_requests > 0 else 0
-    avg_time = sum(metrics_store["generation_times"]) / len(metrics_store["generation_times"]) if metrics_store["generation_times"] else 0
+    collected = collect()
+    counters = collected["counters"]
+    total_requests = int(counters.get("requests", 0))
+    errors = counters.get("errors", 0)
+    cache_hit_rate = (counters.get("cache_hits", 0) / total_requests) * 100 if total_requests > 0 else 0
+    generation = collected["histograms"].get("generation_seconds", {"sum": 0.0, "count": 0})
+    avg_time = generation["sum"] / generation["count"] if generation["count"] else 0
+    successful = total_requests - errors
     
     return {
         "total_requests": total_requests,
         "cache_hit_rate": f"{cache_hit_rate:.1f}%",
         "avg_generation_time": f"{avg_time:.2f}s",
-        "platform_distribution": metrics_store["platform_counts"],
-        "error_rate": f"{(metrics_store['error_count'] / total_requests * 100):.1f}%" if total_requests > 0 else "0%",
-        "avg_reply_length": int(metrics_store["avg_reply_length"])
-    }
\ No newline at end of file
+        "platform_distribution": {platform: int(counters.get(f"platform_{platform}", 0)) for platform in PLATFORMS},
+        "error_rate": f"{(errors / total_requests * 100):.1f}%" if total_requests > 0 else "0%",
+        "avg_reply_length": int(counters.get("total_reply_length", 0) / successful) if successful > 0 else 0,
+        "counters": dict(counters),
+        "gauges": dict(collected["gauges"]),
+        "histograms": {
+            name: summarize_histogram(histogram)
+            for name, histogram in collected["histograms"].items()
+        }
+    }
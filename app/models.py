@@ -1,9 +1,12 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import AnyHttpUrl, BaseModel, Field, field_validator
+from typing import Dict, List, Optional
+
+# Hard cap on accepted posts; long posts are truncated per stage in app.tokens
+MAX_POST_CHARS = 100_000
 
 class ReplyRequest(BaseModel):
     platform: str
-    post_text: str
+    post_text: str = Field(..., max_length=MAX_POST_CHARS)
 
 class ReplyResponse(BaseModel):
     platform: str
@@ -11,7 +14,40 @@ class ReplyResponse(BaseModel):
     generated_reply: str  
     timestamp: str
 
+class FanOutRequest(BaseModel):
+    platforms: List[str] = Field(default_factory=lambda: ["linkedin", "twitter", "instagram"], min_length=1)
+    post_text: str = Field(..., max_length=MAX_POST_CHARS)
+
+class FanOutResponse(BaseModel):
+    post_text: str
+    replies: Dict[str, str]
+    cached_platforms: List[str]
+    timestamp: str
+    # Against one /reply request per generated platform
+    calls_saved: int
+    tokens_saved: int
+
 class DBReply(ReplyResponse):
     id: Optional[str] = Field(None, alias="_id")
 
+class JobRequest(ReplyRequest):
+    # Receives the final JobStatus as a JSON POST when the job finishes or fails
+    callback_url: Optional[AnyHttpUrl] = None
+
+    @field_validator("callback_url")
+    @classmethod
+    def public_callback_host(cls, url: Optional[AnyHttpUrl]) -> Optional[AnyHttpUrl]:
+        from app.jobs import check_callback_host
 
+        if url is not None:
+            check_callback_host(url.host)
+        return url
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    platform: str
+    attempts: int
+    generated_reply: Optional[str] = None
+    timestamp: Optional[str] = None
+    error: Optional[str] = None
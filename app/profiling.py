@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from app.metrics import observe, set_gauge
+
+# Requests slower than this (seconds) keep their per-stage breakdown
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "10"))
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "100"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_DEPTH = 64
+
+# Stages recorded for the request being served, or None outside a request
+_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("stages", default=None)
+
+slow_requests: deque = deque(maxlen=SLOW_REQUEST_BUFFER)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add a timed stage to the current request's breakdown; a no-op outside requests"""
+    stages = _stages.get()
+    if stages is not None:
+        stages.append((stage, round(seconds, 4)))
+
+
+class SlowRequestMiddleware:
+    """
+    ASGI middleware that times each HTTP request, including streamed bodies,
+    and keeps the stage breakdown of the slow ones in `slow_requests`
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Tasks spawned by the request copy the context and share this list
+        stages: List[Tuple[str, float]] = []
+        token = _stages.set(stages)
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _stages.reset(token)
+            elapsed = time.perf_counter() - start
+            if elapsed >= SLOW_REQUEST_THRESHOLD:
+                slow_requests.append({
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "seconds": round(elapsed, 4),
+                    "stages": [{"stage": stage, "seconds": seconds} for stage, seconds in stages],
+                    "unaccounted_seconds": round(max(elapsed - sum(seconds for _, seconds in stages), 0.0), 4)
+                })
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from short sleeps"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.last = 0.0
+        self.max = 0.0
+        self.total = 0.0
+        self.task = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.samples += 1
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.total += lag
+            observe("event_loop_lag_seconds", lag)
+            set_gauge("event_loop_lag_last_seconds", round(lag, 6))
+
+    def summary(self) -> dict:
+        return {
+            "interval": self.interval,
+            "samples": self.samples,
+            "last_seconds": round(self.last, 6),
+            "max_seconds": round(self.max, 6),
+            "mean_seconds": round(self.total / self.samples, 6) if self.samples else 0.0
+        }
+
+
+loop_monitor = LoopLagMonitor()
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def _stack(frame, codes: dict) -> tuple:
+    """
+    Key for a sampled stack: the ids of its code objects, innermost first.
+    Sampling holds the GIL, so labels are only built once per code object
+    when the profile is formatted; `codes` keeps the objects (and ids) alive.
+    """
+    ids = []
+    while frame is not None and len(ids) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        key = id(code)
+        if key not in codes:
+            codes[key] = code
+        ids.append(key)
+        frame = frame.f_back
+    return tuple(ids)
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = PROFILE_INTERVAL) -> str:
+    """
+    Sample every other thread's stack for `seconds` and return them in
+    collapsed-stack format (`thread;outer;...;inner count` per line), ready
+    for flamegraph.pl or speedscope. Blocks; run it in a worker thread.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        own = threading.get_ident()
+        counts: Counter = Counter()
+        codes: dict = {}
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    counts[names.get(ident, ident), _stack(frame, codes)] += 1
+            time.sleep(interval)
+        labels = {key: _label(code) for key, code in codes.items()}
+        collapsed: Counter = Counter()
+        for (thread, stack), count in counts.items():
+            collapsed[";".join([str(thread), *(labels[key] for key in reversed(stack))])] += count
+        return "".join(f"{stack} {count}\n" for stack, count in collapsed.most_common())
+    finally:
+        _profile_lock.release()
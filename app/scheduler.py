@@ -0,0 +1,233 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from app.metrics import increment, observe, set_gauge
+from app.profiling import record_stage
+
+# Concurrent generate_reply calls allowed against Mistral
+SCHEDULER_CAPACITY = int(os.getenv("SCHEDULER_CAPACITY", "4"))
+DEFAULT_PRIORITY = "interactive"
+DEFAULT_TENANT = "anonymous"
+# Assumed duration of one generation until real ones have been measured
+INITIAL_SERVICE_TIME = 5.0
+
+
+class PriorityClass:
+    """Scheduling parameters for one class of /reply traffic"""
+
+    def __init__(self, name: str, weight: float, max_queue: int, deadline: float):
+        self.name = name
+        self.weight = weight          # share of capacity relative to other backlogged classes
+        self.max_queue = max_queue    # waiting requests allowed before rejecting
+        self.deadline = deadline      # seconds a request may take, queueing included
+
+
+PRIORITY_CLASSES = {
+    "interactive": PriorityClass(
+        "interactive",
+        weight=float(os.getenv("INTERACTIVE_WEIGHT", "4")),
+        max_queue=int(os.getenv("INTERACTIVE_QUEUE_DEPTH", "100")),
+        deadline=float(os.getenv("INTERACTIVE_DEADLINE", "30")),
+    ),
+    "bulk": PriorityClass(
+        "bulk",
+        weight=float(os.getenv("BULK_WEIGHT", "1")),
+        max_queue=int(os.getenv("BULK_QUEUE_DEPTH", "1000")),
+        deadline=float(os.getenv("BULK_DEADLINE", "600")),
+    ),
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away instead of queued"""
+
+    def __init__(self, message: str, status_code: int = 429):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Waiter:
+    def __init__(self, priority: str, tenant: str):
+        self.priority = priority
+        self.tenant = tenant
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _FairQueue:
+    """
+    Start-time fair queuing over named flows: each dispatch picks the
+    backlogged flow with the smallest tag and advances it by 1 / weight.
+    Only backlogged flows keep a tag: one that goes idle is forgotten and
+    starts at the current virtual time when it comes back, so it cannot bank
+    credit while idle and flow names (client tenant headers) don't pile up.
+    """
+
+    def __init__(self):
+        self.flows: Dict[str, Deque] = {}
+        self.tags: Dict[str, float] = {}
+        self.virtual_time = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(flow) for flow in self.flows.values())
+
+    def push(self, flow: str, item) -> None:
+        queue = self.flows.get(flow)
+        if not queue:
+            queue = self.flows[flow] = deque()
+            self.tags[flow] = self.virtual_time
+        queue.append(item)
+
+    def next_flow(self) -> Optional[str]:
+        backlogged = [flow for flow, queue in self.flows.items() if queue]
+        if not backlogged:
+            return None
+        return min(backlogged, key=lambda flow: self.tags[flow])
+
+    def pop(self, weights: Dict[str, float] = None):
+        flow = self.next_flow()
+        if flow is None:
+            return None
+        self.virtual_time = self.tags[flow]
+        self.tags[flow] += 1.0 / (weights[flow] if weights else 1.0)
+        item = self.flows[flow].popleft()
+        if not self.flows[flow]:
+            del self.flows[flow]
+            del self.tags[flow]
+        return item
+
+    def remove(self, flow: str, item) -> None:
+        queue = self.flows.get(flow)
+        if queue and item in queue:
+            # Removes the first equal item, which for placeholders is any of them
+            queue.remove(item)
+            if not queue:
+                del self.flows[flow]
+                del self.tags[flow]
+
+
+class AdmissionScheduler:
+    """
+    Admission control in front of generate_reply. Requests take one of
+    `capacity` slots; when all are busy they wait in their priority class,
+    classes share freed slots by weight and tenants within a class share
+    them equally. Requests are rejected up front when their class queue is
+    full or their deadline can't be met at the current service rate.
+    """
+
+    def __init__(self, capacity: int = SCHEDULER_CAPACITY, classes: Dict[str, PriorityClass] = None):
+        self.capacity = capacity
+        self.classes = classes or PRIORITY_CLASSES
+        self.active = 0
+        self.class_queue = _FairQueue()
+        self.tenant_queues: Dict[str, _FairQueue] = {name: _FairQueue() for name in self.classes}
+        self.avg_service_time = INITIAL_SERVICE_TIME
+
+    def resolve_class(self, priority: Optional[str]) -> PriorityClass:
+        return self.classes.get((priority or DEFAULT_PRIORITY).lower(), self.classes[DEFAULT_PRIORITY])
+
+    def queue_depth(self, priority: str) -> int:
+        return len(self.tenant_queues[priority])
+
+    def estimate_wait(self, priority_class: PriorityClass) -> float:
+        """Rough queueing delay for a new request in this class"""
+        backlogged = {name for name in self.classes if self.queue_depth(name)} | {priority_class.name}
+        share = priority_class.weight / sum(self.classes[name].weight for name in backlogged)
+        slots = max(self.capacity * share, 1e-9)
+        ahead = self.queue_depth(priority_class.name)
+        return (ahead // slots + 1) * self.avg_service_time if ahead or self.active >= self.capacity else 0.0
+
+    async def acquire(self, priority: Optional[str] = None, tenant: Optional[str] = None,
+                      deadline: Optional[float] = None) -> None:
+        """Wait for a slot; `deadline` is the caller's remaining budget in seconds"""
+        priority_class = self.resolve_class(priority)
+        name = priority_class.name
+        tenant = tenant or DEFAULT_TENANT
+        budget = priority_class.deadline if deadline is None else min(deadline, priority_class.deadline)
+
+        if self.active < self.capacity and not len(self.class_queue):
+            self.active += 1
+            observe(f"scheduler_wait_seconds_{name}", 0.0)
+            return
+
+        if self.queue_depth(name) >= priority_class.max_queue:
+            increment(f"scheduler_rejected_queue_full_{name}")
+            raise AdmissionRejected(f"{name} queue is full", status_code=429)
+
+        if self.estimate_wait(priority_class) + self.avg_service_time > budget:
+            increment(f"scheduler_rejected_deadline_{name}")
+            raise AdmissionRejected(f"{name} deadline of {budget:.1f}s cannot be met", status_code=503)
+
+        waiter = _Waiter(name, tenant)
+        # The class queue only holds placeholders; it decides which class is served next
+        self.class_queue.push(name, None)
+        self.tenant_queues[name].push(tenant, waiter)
+        self._update_depth(name)
+
+        try:
+            # Give up early enough that the work itself still fits in the budget
+            timeout = max(budget - self.avg_service_time, 0.0)
+            await asyncio.wait({waiter.future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(time.monotonic() - waiter.enqueued_at, measured=False)
+            else:
+                self._discard(waiter)
+            raise
+
+        # Check the future itself: a slot may have been handed over after the timeout fired
+        if not waiter.future.done():
+            self._discard(waiter)
+            increment(f"scheduler_rejected_deadline_{name}")
+            raise AdmissionRejected(f"{name} deadline expired while queued", status_code=503)
+
+        waited = time.monotonic() - waiter.enqueued_at
+        observe(f"scheduler_wait_seconds_{name}", waited)
+        record_stage("scheduler_wait", waited)
+
+    def release(self, service_time: float, measured: bool = True) -> None:
+        """Free a slot and hand it to the next waiter"""
+        self.active -= 1
+        if measured:
+            # Exponentially weighted so the estimate follows current upstream latency
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[str] = None, tenant: Optional[str] = None,
+                   deadline: Optional[float] = None):
+        """Hold a slot for the duration of the block"""
+        await self.acquire(priority, tenant, deadline)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def _dispatch(self) -> None:
+        weights = {name: priority_class.weight for name, priority_class in self.classes.items()}
+        while self.active < self.capacity:
+            # Pick the class by weight, then the tenant within it
+            name = self.class_queue.next_flow()
+            if name is None:
+                return
+            self.class_queue.pop(weights)
+            waiter = self.tenant_queues[name].pop()
+            self._update_depth(name)
+            self.active += 1
+            waiter.future.set_result(True)
+
+    def _discard(self, waiter: _Waiter) -> None:
+        self.class_queue.remove(waiter.priority, None)
+        self.tenant_queues[waiter.priority].remove(waiter.tenant, waiter)
+        self._update_depth(waiter.priority)
+
+    def _update_depth(self, name: str) -> None:
+        set_gauge(f"scheduler_queue_depth_{name}", self.queue_depth(name))
+
+
+scheduler = AdmissionScheduler()
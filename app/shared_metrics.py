@@ -0,0 +1,119 @@
+# Multiprocess metrics storage for `uvicorn --workers N`.
+#
+# Each worker process owns one fixed-layout memory-mapped file in
+# METRICS_MULTIPROC_DIR and is its only writer, so updates need no locks or
+# IPC. `/metrics` in any worker sums every file in the directory.
+#
+# File layout (little-endian):
+#     header  64 bytes   magic (8s), slot capacity (u32), slots used (u32), pid (i64), padding
+#     slot    64 bytes   name (56 bytes, UTF-8, NUL padded), value (f64)
+#
+# A slot is written in full before the header's used count is bumped, so
+# readers only ever see complete slots.
+import glob
+import mmap
+import os
+import struct
+from typing import Dict, Tuple
+
+MAGIC = b"HLRMETR1"
+HEADER = struct.Struct("<8sIIq")
+HEADER_SIZE = 64
+NAME_SIZE = 56
+SLOT_SIZE = NAME_SIZE + 8
+VALUE = struct.Struct("<d")
+USED_OFFSET = 12  # byte offset of the used-slot count inside the header
+
+DEFAULT_SLOTS = 4096
+
+
+class SharedMetricsFile:
+    """The current process's stripe: a name -> float64 table in a memory-mapped file"""
+
+    def __init__(self, directory: str, slots: int = DEFAULT_SLOTS):
+        self.pid = os.getpid()
+        self.slots = slots
+        self.path = os.path.join(directory, f"metrics-{self.pid}.bin")
+        self.offsets: Dict[str, int] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        size = HEADER_SIZE + slots * SLOT_SIZE
+        with open(self.path, "w+b") as f:
+            f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(self.mm, 0, MAGIC, slots, 0, self.pid)
+
+    def _offset(self, name: str) -> int:
+        offset = self.offsets.get(name)
+        if offset is not None:
+            return offset
+
+        encoded = name.encode()
+        if len(encoded) > NAME_SIZE:
+            raise ValueError(f"metric name too long for shared storage: {name!r}")
+        used = len(self.offsets)
+        if used >= self.slots:
+            raise MemoryError(f"shared metrics file is full ({self.slots} slots)")
+
+        offset = HEADER_SIZE + used * SLOT_SIZE
+        VALUE.pack_into(self.mm, offset + NAME_SIZE, 0.0)
+        self.mm[offset:offset + len(encoded)] = encoded
+        # Publish the slot only once it is fully written
+        struct.pack_into("<I", self.mm, USED_OFFSET, used + 1)
+        self.offsets[name] = offset
+        return offset
+
+    def add(self, name: str, amount: float) -> None:
+        offset = self._offset(name) + NAME_SIZE
+        VALUE.pack_into(self.mm, offset, VALUE.unpack_from(self.mm, offset)[0] + amount)
+
+    def set(self, name: str, value: float) -> None:
+        VALUE.pack_into(self.mm, self._offset(name) + NAME_SIZE, value)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_file(path: str) -> Tuple[int, Dict[str, float]]:
+    """Return (pid, {name: value}) for one worker's file"""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, slots, used, pid = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                return pid, {}
+            values = {}
+            for i in range(min(used, slots)):
+                offset = HEADER_SIZE + i * SLOT_SIZE
+                name = mm[offset:offset + NAME_SIZE].rstrip(b"\0").decode()
+                values[name] = VALUE.unpack_from(mm, offset + NAME_SIZE)[0]
+            return pid, values
+
+
+def aggregate(directory: str, live_only_prefix: str = "g:") -> Dict[str, float]:
+    """
+    Sum every worker's values. Names starting with `live_only_prefix`
+    (gauges) are only taken from workers that are still running; counters
+    and histograms from exited workers still count toward the totals.
+    """
+    totals: Dict[str, float] = {}
+    for path in glob.glob(os.path.join(directory, "metrics-*.bin")):
+        try:
+            pid, values = read_file(path)
+        except (OSError, ValueError):
+            continue
+        alive = None
+        for name, value in values.items():
+            if name.startswith(live_only_prefix):
+                if alive is None:
+                    alive = _pid_alive(pid)
+                if not alive:
+                    continue
+            totals[name] = totals.get(name, 0.0) + value
+    return totals
@@ -0,0 +1,83 @@
+import os
+import re
+from typing import List
+
+from app.metrics import increment
+
+# Mistral's tokenizer averages about 4 characters per token on English prose
+CHARS_PER_TOKEN = 4
+TOKENS_PER_WORD = 1.3
+
+# Input token budget for the post text in each stage's prompt
+STAGE_INPUT_BUDGETS = {
+    "analyze": int(os.getenv("ANALYZE_INPUT_BUDGET", "600")),
+    "personalize": int(os.getenv("PERSONALIZE_INPUT_BUDGET", "400")),
+}
+
+# Sentences always kept from the start of a long post
+LEAD_SENTENCES = 2
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_HASHTAG = re.compile(r"#\w+")
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate; takes the larger of the character- and word-based guesses"""
+    if not text:
+        return 0
+    return max(len(text) // CHARS_PER_TOKEN, int(len(text.split()) * TOKENS_PER_WORD))
+
+def truncate_post(post_text: str, budget: int) -> str:
+    """
+    Shorten a post to roughly `budget` tokens by extracting sentences: the
+    lead sentences first, then questions, then the rest in order. Picked
+    sentences keep their original order and any hashtags that were dropped
+    are appended at the end.
+    """
+    if estimate_tokens(post_text) <= budget:
+        return post_text
+
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(post_text) if s and s.strip()]
+    if not sentences:
+        # Only whitespace, which costs tokens but says nothing
+        return post_text.strip()
+    hashtags = list(dict.fromkeys(_HASHTAG.findall(post_text)))
+    remaining = budget - estimate_tokens(" ".join(hashtags))
+
+    lead = list(range(min(LEAD_SENTENCES, len(sentences))))
+    questions = [i for i, s in enumerate(sentences) if "?" in s and i not in lead]
+    rest = [i for i in range(len(sentences)) if i not in lead and i not in questions]
+
+    picked: List[int] = []
+    for i in lead + questions + rest:
+        cost = estimate_tokens(sentences[i])
+        if cost <= remaining:
+            picked.append(i)
+            remaining -= cost
+
+    # Per-sentence estimates don't add up exactly, so drop the lowest-priority
+    # picks until the assembled text fits
+    while picked:
+        text = _assemble(sentences, picked, hashtags)
+        if estimate_tokens(text) <= budget:
+            return text
+        picked.pop()
+
+    # Even the first sentence is too long; hard-cut it
+    return sentences[0][:max(budget, 1) * CHARS_PER_TOKEN]
+
+def _assemble(sentences: List[str], picked: List[int], hashtags: List[str]) -> str:
+    text = " ".join(sentences[i] for i in sorted(picked))
+    missing = [tag for tag in hashtags if tag not in text]
+    if missing:
+        text += "\n" + " ".join(missing)
+    return text
+
+def fit_to_budget(stage: str, post_text: str) -> str:
+    """Truncate the post for `stage` and count the input tokens saved"""
+    budget = STAGE_INPUT_BUDGETS[stage]
+    fitted = truncate_post(post_text, budget)
+    if fitted is not post_text:
+        saved = estimate_tokens(post_text) - estimate_tokens(fitted)
+        increment("prompt_tokens_saved", saved)
+        increment(f"prompt_tokens_saved_{stage}", saved)
+    return fitted
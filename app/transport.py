@@ -0,0 +1,97 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import Dict
+
+from app.metrics import increment, observe
+
+# Pool and timeout settings shared by every outbound HTTP client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+# Only used when the optional `h2` package is installed
+HTTP2 = os.getenv("HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Connections belong to the loop that opened them, so clients are kept per
+# event loop and dropped with it
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, object]]" = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _tracer(name: str):
+    """
+    httpcore trace hook for one request: counts whether it opened a new
+    connection or reused a pooled one, and times TLS handshakes
+    """
+    state = {"connected": False, "tls_started": None}
+
+    async def trace(event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.complete":
+            state["connected"] = True
+            increment(f"http_connections_new_{name}")
+        elif event == "connection.start_tls.started":
+            state["tls_started"] = time.perf_counter()
+        elif event == "connection.start_tls.complete":
+            increment(f"http_tls_handshakes_{name}")
+            observe(f"http_tls_seconds_{name}", time.perf_counter() - state["tls_started"])
+        elif event.endswith(".send_request_headers.started"):
+            increment(f"http_requests_{name}")
+            if not state["connected"]:
+                increment(f"http_connections_reused_{name}")
+
+    return trace
+
+
+def _create(name: str, **options):
+    import httpx
+
+    async def attach_trace(request: "httpx.Request") -> None:
+        request.extensions["trace"] = _tracer(name)
+
+    options.setdefault("timeout", httpx.Timeout(
+        HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT
+    ))
+    options.setdefault("follow_redirects", True)
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        http2=_http2_available(),
+        event_hooks={"request": [attach_trace]},
+        **options
+    )
+
+
+def get_async_client(name: str = "default", **options):
+    """
+    Pooled `httpx.AsyncClient` for `name` on the running event loop, created
+    on first use. `options` (e.g. `base_url`, `timeout`) apply on creation.
+    Metrics are reported under `http_*_{name}`.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = clients[name] = _create(name, **options)
+    return client
+
+
+async def close_clients() -> None:
+    """Close the running loop's clients, e.g. on shutdown"""
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
@@ -0,0 +1,61 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Add the project root to Python's path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.cache import CACHE_EXPIRY, cache, generate_cache_key
+from app.cache_snapshot import load_snapshot, save_snapshot
+
+# Time snapshot and restore of a large synthetic reply cache. Entries are
+# inserted oldest first, as in a live cache, and restore runs "later" so
+# the oldest `--expired` share has expired and must be skipped. Example:
+#     python scripts/bench_cache_snapshot.py --entries 1000000 --expired 0.1
+
+WORDS = ("great", "point", "love", "this", "congrats", "team", "really", "curious", "how", "you",
+         "handled", "the", "launch", "thanks", "for", "sharing", "totally", "agree", "what's", "next")
+
+def fill(entries: int, now: float) -> None:
+    rng = random.Random(42)
+    cache.clear()
+    # Ages spread evenly over the expiry window, oldest first
+    span = CACHE_EXPIRY - 120
+    for i in range(entries):
+        reply = " ".join(rng.choice(WORDS) for _ in range(rng.randint(15, 45)))
+        cache[generate_cache_key("twitter", f"post {i}")] = (reply, now - CACHE_EXPIRY + 60 + span * i / entries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cache snapshot and restore")
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--expired", type=float, default=0.1, help="share of entries expired by restore time")
+    args = parser.parse_args()
+
+    now = time.time()
+    fill(args.entries, now)
+    raw_bytes = sum(len(key) + len(reply.encode()) for key, (reply, _) in cache.items())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.snapshot")
+
+        start = time.perf_counter()
+        written = save_snapshot(path)
+        snapshot_seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        cache.clear()
+        restore_at = now + 60 + (CACHE_EXPIRY - 120) * args.expired
+        start = time.perf_counter()
+        restored, skipped = load_snapshot(path, now=restore_at)
+        restore_seconds = time.perf_counter() - start
+
+    print(f"entries:   {args.entries:,} ({raw_bytes / 1e6:.1f} MB of keys and replies)")
+    print(f"snapshot:  {written:,} entries in {snapshot_seconds:.2f}s, {size / 1e6:.1f} MB on disk")
+    print(f"restore:   {restored:,} entries in {restore_seconds:.2f}s "
+          f"({restored / restore_seconds:,.0f}/s), {skipped:,} expired skipped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+# Add the project root to Python's path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.metrics import collect
+from app.transport import close_clients, get_async_client
+
+# Compare Mistral chat calls made through app.transport's pooled per-loop
+# client with a fresh client per call (no connection reuse), against a local
+# fake Mistral server. Example:
+#     python scripts/bench_http_pool.py --requests 1000 --concurrency 20 --latency 0.02
+
+COMPLETION = json.dumps({
+    "id": "bench",
+    "object": "chat.completion",
+    "model": "mistral-small-latest",
+    "created": 0,
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Nice work!"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 50, "completion_tokens": 5, "total_tokens": 55}
+}).encode()
+
+
+class FakeMistral(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    latency = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with FakeMistral.lock:
+            FakeMistral.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+async def run(mode: str, url: str, requests: int, concurrency: int) -> dict:
+    from mistralai import Mistral
+
+    if mode == "pooled":
+        pooled = Mistral(api_key="bench", server_url=url, async_client=get_async_client("bench"))
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            if mode == "pooled":
+                await pooled.chat.complete_async(model="mistral-small-latest", messages=[{"role": "user", "content": "hi"}])
+            else:
+                async with httpx.AsyncClient() as fresh:
+                    client = Mistral(api_key="bench", server_url=url, async_client=fresh)
+                    await client.chat.complete_async(model="mistral-small-latest", messages=[{"role": "user", "content": "hi"}])
+            latencies.append(time.perf_counter() - start)
+
+    connections_before = FakeMistral.connections
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await close_clients()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "server_connections": FakeMistral.connections - connections_before
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs per-call HTTP clients against a fake Mistral server")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.01, help="fake server think time per call, seconds")
+    args = parser.parse_args()
+
+    FakeMistral.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMistral)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    for mode in ("fresh", "pooled"):
+        print(json.dumps(asyncio.run(run(mode, url, args.requests, args.concurrency))))
+
+    counters = collect()["counters"]
+    print(json.dumps({
+        "pooled_requests": counters.get("http_requests_bench", 0),
+        "pooled_new_connections": counters.get("http_connections_new_bench", 0),
+        "pooled_reused_connections": counters.get("http_connections_reused_bench", 0)
+    }))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # Now we can import from app
 from app.ai import generate_reply
 from app.db import save_reply
-from mistralai.models.sdkerror import SDKError
+from app.transport import close_clients
 
 load_dotenv()
 
@@ -26,6 +26,8 @@ PROGRESS_FILE = os.path.join(SCRIPT_DIR, "import_progress.txt")
 
 async def generate_reply_with_retry(platform, post_text, max_retries=5):
     """Generate a reply with retry logic for rate limits"""
+    from mistralai.models.sdkerror import SDKError
+
     retries = 0
     base_delay = 2  # Start with a 2-second delay
     
@@ -100,6 +102,9 @@ async def import_posts():
         print(f"Current directory: {os.getcwd()}")
         print(f"Script directory: {SCRIPT_DIR}")
         print("Please make sure the CSV file is in the correct location.")
+    finally:
+        # Every reply reused this loop's pooled Mistral connection
+        await close_clients()
 
 if __name__ == "__main__":
     asyncio.run(import_posts())
\ No newline at end of file
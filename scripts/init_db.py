@@ -1,44 +1,22 @@
 import os
+import sys
 from pymongo import MongoClient
 
+# Add the project root to Python's path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db import REPLIES_VALIDATOR
+
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 client = MongoClient(MONGO_URI)
 db = client.social_reply_db4
 
-# Create collection if it doesn't exist
-if "replies" not in db.list_collection_names():
-    db.create_collection("replies")
+# Create collections if they don't exist
+for name in ("replies", "posts"):
+    if name not in db.list_collection_names():
+        db.create_collection(name)
 
 # Set schema validation
-db.command({
-    "collMod": "replies",
-    "validator": {
-        "$jsonSchema": {
-            "bsonType": "object",
-            "required": ["platform", "post_text", "generated_reply", "timestamp"],
-            "properties": {
-                "platform": {
-                    "bsonType": "string",
-                    "enum": ["twitter", "linkedin", "instagram"],
-                    "description": "must be a valid platform"
-                },
-                "post_text": {
-                    "bsonType": "string",
-                    "minLength": 1,
-                    "description": "must be a non-empty string"
-                },
-                "generated_reply": {
-                    "bsonType": "string",
-                    "minLength": 1,
-                    "description": "must be a non-empty string"
-                },
-                "timestamp": {
-                    "bsonType": "date",
-                    "description": "must be a valid date"
-                }
-            }
-        }
-    }
-})
+db.command({"collMod": "replies", "validator": REPLIES_VALIDATOR})
 
 print("Database and collection initialized with schema validation.")
\ No newline at end of file
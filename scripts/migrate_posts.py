@@ -0,0 +1,58 @@
+import os
+import sys
+from pymongo import MongoClient, UpdateOne
+
+# Add the project root to Python's path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db import REPLIES_VALIDATOR, encode_post
+
+# Move inline `post_text` out of `replies` into the deduplicated `posts` collection.
+# Safe to re-run: posts are upserted by content hash and migrated replies are skipped.
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "500"))
+
+client = MongoClient(MONGO_URI)
+db = client.social_reply_db4
+
+def migrate_batch(replies):
+    """Upsert the batch's posts, then point its replies at them"""
+    post_ops = {}
+    reply_ops = []
+    for reply in replies:
+        doc = encode_post(reply["post_text"])
+        post_id = doc.pop("_id")
+        post_ops[post_id] = UpdateOne({"_id": post_id}, {"$setOnInsert": doc}, upsert=True)
+        reply_ops.append(UpdateOne(
+            {"_id": reply["_id"]},
+            {"$set": {"post_id": post_id}, "$unset": {"post_text": ""}}
+        ))
+
+    db.posts.bulk_write(list(post_ops.values()), ordered=False)
+    db.replies.bulk_write(reply_ops, ordered=False)
+    return len(post_ops)
+
+def migrate():
+    # The old validator requires `post_text`, which would reject every migrated reply
+    db.command({"collMod": "replies", "validator": REPLIES_VALIDATOR})
+    print("Applied the replies validator that accepts post_id")
+
+    migrated = 0
+    posts_written = 0
+    while True:
+        batch = list(db.replies.find(
+            {"post_text": {"$exists": True}},
+            {"post_text": 1},
+            limit=BATCH_SIZE
+        ))
+        if not batch:
+            break
+        posts_written += migrate_batch(batch)
+        migrated += len(batch)
+        print(f"Migrated {migrated} replies ({posts_written} post upserts)")
+
+    print(f"Done: {migrated} replies now reference {db.posts.count_documents({})} stored posts.")
+
+if __name__ == "__main__":
+    migrate()
@@ -10,7 +10,7 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 load_dotenv()
 
 # Import our mocks so they're available to all tests
-from tests.mocks import mock_mistral_client, mock_db
+from tests.mocks import mock_mistral_client, mock_db, stage_client
 
 @pytest.fixture
 def sample_posts():
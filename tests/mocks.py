@@ -2,52 +2,203 @@ from unittest.mock import MagicMock
 import pytest
 from bson import ObjectId
 
+_OPERATORS = {
+    "$in": lambda value, arg: value in arg,
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$exists": lambda value, arg: (value is not None) == arg,
+}
+
+def _matches(doc, query):
+    """Equality, `$or` and a few comparison operators, enough for the queries the app issues"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            if not all(_OPERATORS[op](value, arg) for op, arg in condition.items()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+def _apply_update(doc, update):
+    doc.update(update.get("$set", {}))
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+    for key, amount in update.get("$inc", {}).items():
+        doc[key] = doc.get(key, 0) + amount
+
+class MockCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs = sorted(self.docs, key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n] if n else self.docs
+        return self
+
+    async def to_list(self, length=None):
+        return [d.copy() for d in self.docs[:length]]
+
+    def __aiter__(self):
+        self._iter = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter).copy()
+        except StopIteration:
+            raise StopAsyncIteration
+
+class MockCollection:
+    def __init__(self):
+        self.stored = {}
+        self.calls = []
+        self.indexes = []
+
+    def _normalize_id(self, _id):
+        if isinstance(_id, str) and ObjectId.is_valid(_id) and len(_id) == 24:
+            return ObjectId(_id)
+        return _id
+
+    async def insert_one(self, doc):
+        self.calls.append("insert_one")
+        # emulate storing with a real ObjectId
+        _id = doc.get("_id", ObjectId())
+        d = doc.copy()
+        d["_id"] = _id
+        self.stored[_id] = d
+        m = MagicMock()
+        m.inserted_id = _id
+        return m
+
+    async def insert_many(self, docs):
+        self.calls.append("insert_many")
+        ids = []
+        for doc in docs:
+            _id = doc.get("_id", ObjectId())
+            self.stored[_id] = dict(doc, _id=_id)
+            ids.append(_id)
+        m = MagicMock()
+        m.inserted_ids = ids
+        return m
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append("update_one")
+        _id = self._normalize_id(query.get("_id"))
+        doc = self.stored.get(_id)
+        if doc is not None and not _matches(doc, dict(query, _id=_id)):
+            doc = None
+        if doc is None:
+            if not upsert:
+                return MagicMock(matched_count=0)
+            doc = {"_id": _id}
+            doc.update(update.get("$setOnInsert", {}))
+            self.stored[_id] = doc
+        _apply_update(doc, update)
+        return MagicMock(matched_count=1)
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=False):
+        self.calls.append("find_one_and_update")
+        docs = [d for d in self.stored.values() if _matches(d, query)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        if not docs:
+            return None
+        before = docs[0].copy()
+        _apply_update(docs[0], update)
+        return docs[0].copy() if return_document else before
+
+    async def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+        return keys if isinstance(keys, str) else "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.stored.values() if _matches(d, query))
+
+    def find(self, query=None, projection=None):
+        self.calls.append("find")
+        return MockCursor([d for d in self.stored.values() if _matches(d, query or {})])
+
+    async def find_one(self, query):
+        doc = self.stored.get(self._normalize_id(query.get("_id")))
+        return doc.copy() if doc else None
+
+    async def delete_one(self, query):
+        self.stored.pop(self._normalize_id(query.get("_id")), None)
+        return MagicMock()
+
+# Stage of a call, identified by the temperature each one uses in app.ai
+STAGE_BY_TEMPERATURE = {0.3: "analyze", 0.7: "personalize", 0.5: "refine", 0.9: "variants"}
+
+def completion(content):
+    """Chat completion response whose first choice says `content`"""
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=content))]
+    return response
+
+class StageClient:
+    """
+    Fake Mistral client that tells the generation stages apart (fan-out
+    calls by their JSON response format, the rest by temperature), sleeps
+    `delays[stage]` seconds and answers with `respond(stage, messages)`.
+    Stages called are recorded in `calls` and their messages in `sent`.
+    """
+
+    def __init__(self, respond=None):
+        self.delays = {stage: 0 for stage in (*STAGE_BY_TEMPERATURE.values(), "fanout")}
+        self.respond = respond or (lambda stage, messages: f"{stage} output")
+        self.calls = []
+        self.sent = []
+        self.chat = MagicMock()
+        self.chat.complete_async = self.complete_async
+
+    async def complete_async(self, *, model, messages, temperature=None, **kwargs):
+        import asyncio
+
+        stage = "fanout" if kwargs.get("response_format") else STAGE_BY_TEMPERATURE[temperature]
+        self.calls.append(stage)
+        self.sent.append(messages)
+        if self.delays[stage]:
+            await asyncio.sleep(self.delays[stage])
+        return completion(self.respond(stage, messages))
+
+@pytest.fixture
+def stage_client(monkeypatch):
+    """Install a StageClient as app.ai's Mistral client; set `.respond` and `.delays` per test"""
+    import app.ai
+
+    client = StageClient()
+    monkeypatch.setattr(app.ai, "get_client", lambda: client)
+    return client
+
 @pytest.fixture(autouse=True)
 def mock_db(monkeypatch):
-    """Mock MongoDB operations on the real `app.db.database.replies`."""
-    stored = {}
-
-    class MockCollection:
-        async def insert_one(self, doc):
-            # emulate storing with a real ObjectId
-            _id = ObjectId()
-            d = doc.copy()
-            d["_id"] = _id
-            stored[_id] = d
-            m = MagicMock()
-            m.inserted_id = _id
-            return m
-
-        async def find_one(self, query):
-            _id = query.get("_id")
-            if isinstance(_id, str):
-                try:
-                    _id = ObjectId(_id)
-                except:
-                    return None
-            return stored.get(_id)
-
-        async def delete_one(self, query):
-            _id = query.get("_id")
-            if isinstance(_id, str):
-                try:
-                    _id = ObjectId(_id)
-                except:
-                    return MagicMock()
-            stored.pop(_id, None)
-            return MagicMock()
-
-    # Patch only the .replies collection on the existing database object
+    """Mock MongoDB operations on the real `app.db.database` collections."""
     import app.db
-    monkeypatch.setattr(app.db.database, "replies", MockCollection(), raising=True)
+    collections = {"replies": MockCollection(), "posts": MockCollection(), "jobs": MockCollection()}
+    # Patch only the collections on the existing database object
+    for name, collection in collections.items():
+        monkeypatch.setattr(app.db.database, name, collection, raising=True)
+    return collections
 
 @pytest.fixture
 def mock_mistral_client(monkeypatch):
-    """Mock Mistral client.chat.complete to avoid real API calls."""
-    from app.ai import client
+    """Mock Mistral client.chat.complete_async to avoid real API calls."""
+    import app.ai
+
+    # Install a stand-in client so no MISTRAL_API_KEY is needed
+    client = MagicMock()
+    monkeypatch.setattr(app.ai, "get_client", lambda: client)
 
-    # This should NOT be an async function
-    def fake_complete(*, model, messages, **kwargs):
+    async def fake_complete(*, model, messages, **kwargs):
         # Check if this is an analysis request by looking at the system prompt
         is_analysis = False
         for message in messages:
@@ -71,5 +222,5 @@ def mock_mistral_client(monkeypatch):
         resp.choices = [choice]
         return resp
 
-    monkeypatch.setattr(client.chat, "complete", fake_complete)
+    monkeypatch.setattr(client.chat, "complete_async", fake_complete)
     return True  # fixture value unused
@@ -2,6 +2,7 @@ import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
@@ -14,7 +15,9 @@ client = TestClient(app)
 def mock_api_dependencies():
     """Mock API dependencies for testing"""
     # Define mocks
-    async def mock_generate_reply(platform, post_text):
+    async def mock_generate_reply(platform, post_text, deadline=None, on_stage=None):
+        if on_stage:
+            on_stage("draft", f"Draft reply for {platform}")
         return f"This is a mocked reply for {platform}"
     
     async def mock_save_reply(data):
@@ -58,4 +61,18 @@ def test_error_handling():
     )
     
     # Should return a validation error
-    assert response.status_code == 422
\ No newline at end of file
+    assert response.status_code == 422
+
+def test_reply_stream_endpoint():
+    """The streaming endpoint emits partial stages and then the final reply"""
+    with patch("app.main.get_cached_reply", return_value=None):
+        response = client.post(
+            "/reply/stream",
+            json={"platform": "linkedin", "post_text": "Started a new role today"}
+        )
+
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["draft", "reply"]
+    assert events[0]["data"] == "Draft reply for linkedin"
+    assert "mocked reply for linkedin" in events[-1]["data"]["generated_reply"].lower()
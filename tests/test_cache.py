@@ -0,0 +1,106 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import pytest
+
+import app.cache
+import app.main
+from app.cache import (
+    cache_reply, get_cached_reply, claim_variant_fill, store_variants, variant_pools, generate_cache_key
+)
+
+POST = "Our team just hit 1,000 customers!"
+
+@pytest.fixture(autouse=True)
+def variant_mode(monkeypatch):
+    monkeypatch.setattr(app.cache, "VARIANT_POOL_SIZE", 3)
+    monkeypatch.setattr(app.cache, "VARIANT_HOT_THRESHOLD", 2)
+    monkeypatch.setattr(app.main, "VARIANT_POOL_SIZE", 3)
+    for state in (app.cache.cache, app.cache.variant_pools, app.cache.request_counts, app.cache._filling):
+        state.clear()
+    yield
+    for state in (app.cache.cache, app.cache.variant_pools, app.cache.request_counts, app.cache._filling):
+        state.clear()
+
+def test_hot_key_is_claimed_once():
+    cache_reply("twitter", POST, "original")
+    assert get_cached_reply("twitter", POST) == "original"
+    assert not claim_variant_fill("twitter", POST)
+
+    assert get_cached_reply("twitter", POST) == "original"
+    assert claim_variant_fill("twitter", POST)
+    # Already being filled
+    assert not claim_variant_fill("twitter", POST)
+
+def test_pool_is_served_round_robin():
+    cache_reply("twitter", POST, "original")
+    store_variants("twitter", POST, ["original", "variant a", "variant a", "variant b", "variant c"])
+
+    served = [get_cached_reply("twitter", POST) for _ in range(4)]
+    assert served == ["variant a", "variant b", "original", "variant a"]
+
+def test_random_mode_serves_from_pool(monkeypatch):
+    monkeypatch.setattr(app.cache, "VARIANT_SERVE_MODE", "random")
+    cache_reply("twitter", POST, "original")
+    store_variants("twitter", POST, ["original", "variant a", "variant b"])
+
+    served = {get_cached_reply("twitter", POST) for _ in range(50)}
+    assert served <= {"original", "variant a", "variant b"}
+    assert len(served) > 1
+
+def _heat(name, hits):
+    cache_reply("linkedin", name, f"{name} original")
+    for _ in range(hits):
+        get_cached_reply("linkedin", name)
+
+def test_least_popular_pool_is_evicted(monkeypatch):
+    monkeypatch.setattr(app.cache, "VARIANT_MAX_POOLS", 2)
+    for name, hits in (("cold", 2), ("warm", 5), ("hot", 4)):
+        _heat(name, hits)
+        store_variants("linkedin", name, [f"{name} original", f"{name} variant"])
+
+    assert set(variant_pools) == {generate_cache_key("linkedin", "warm"), generate_cache_key("linkedin", "hot")}
+    # The evicted key starts over instead of immediately claiming a new fill
+    assert generate_cache_key("linkedin", "cold") not in app.cache.request_counts
+
+def test_full_pools_only_admit_hotter_keys(monkeypatch):
+    monkeypatch.setattr(app.cache, "VARIANT_MAX_POOLS", 2)
+    for name in ("a", "b"):
+        _heat(name, 4)
+        store_variants("linkedin", name, [f"{name} original", f"{name} variant"])
+
+    # Hot enough for a pool, but not hotter than the coldest one: no upstream call
+    _heat("c", 3)
+    assert not claim_variant_fill("linkedin", "c")
+    store_variants("linkedin", "c", ["c original", "c variant"])
+    assert generate_cache_key("linkedin", "c") not in variant_pools
+
+    get_cached_reply("linkedin", "c")
+    get_cached_reply("linkedin", "c")
+    assert claim_variant_fill("linkedin", "c")
+
+def test_cleanup_halves_request_counts():
+    _heat("steady", 5)
+    _heat("once", 1)
+    app.cache.cleanup_cache()
+
+    assert app.cache.request_counts == {generate_cache_key("linkedin", "steady"): 2}
+
+async def test_fill_uses_one_multi_sample_call(monkeypatch):
+    calls = []
+
+    async def fake_generate_variants(platform, reply, n, deadline=None):
+        calls.append((platform, reply, n))
+        return [f"variant {i}" for i in range(n)]
+
+    monkeypatch.setattr(app.main, "generate_variants", fake_generate_variants)
+    cache_reply("instagram", POST, "original")
+    get_cached_reply("instagram", POST)
+    get_cached_reply("instagram", POST)
+    assert claim_variant_fill("instagram", POST)
+
+    await app.main.fill_variant_pool("instagram", POST, "original")
+    assert calls == [("instagram", "original", 2)]
+    assert [get_cached_reply("instagram", POST) for _ in range(3)] == ["variant 0", "variant 1", "original"]
+    assert not app.cache._filling
@@ -0,0 +1,122 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.cache_snapshot
+import app.main
+from app.cache import CACHE_EXPIRY, cache, cache_reply, get_cached_reply
+from app.cache_snapshot import load_snapshot, save_snapshot, write_snapshot
+from app.metrics import metrics_store
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    cache_reply("twitter", "short", "ok")
+    cache_reply("linkedin", "long", "A much longer reply that is worth compressing. " * 5)
+    cache_reply("instagram", "unicode", "Love this ☀️🌊")
+    before = dict(cache)
+
+    assert save_snapshot(path) == 3
+    cache.clear()
+    assert load_snapshot(path) == (3, 0)
+    assert cache.keys() == before.keys()
+    for key, (reply, cached_at) in before.items():
+        assert cache[key][0] == reply
+        assert cache[key][1] == pytest.approx(cached_at)
+
+def test_expired_entries_are_skipped(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.snapshot")
+    monkeypatch.setattr(app.cache_snapshot, "BLOCK_ENTRIES", 2)
+    now = time.time()
+    # Oldest first, as in the live cache; the first block expires entirely
+    for i, age in enumerate((CACHE_EXPIRY - 10, CACHE_EXPIRY - 20, CACHE_EXPIRY - 100, 10)):
+        cache[f"key{i}"] = (f"reply {i}", now - age)
+    cache["already-expired"] = ("gone", now - CACHE_EXPIRY - 1)
+    assert save_snapshot(path) == 4
+    cache.clear()
+
+    decoded = []
+    real = app.cache_snapshot._decompressors
+    def counting_decompressors():
+        return {encoding: (lambda data, fn=fn: decoded.append(len(data)) or fn(data)) for encoding, fn in real().items()}
+    monkeypatch.setattr(app.cache_snapshot, "_decompressors", counting_decompressors)
+
+    assert load_snapshot(path, now=now + 50) == (2, 2)
+    assert set(cache) == {"key2", "key3"}
+    # Only the live block was decompressed
+    assert len(decoded) == 1
+
+def test_restore_keeps_newer_entries(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    cache_reply("twitter", "post", "old reply")
+    save_snapshot(path)
+    cache_reply("twitter", "post", "new reply")
+
+    assert load_snapshot(path) == (0, 0)
+    assert get_cached_reply("twitter", "post") == "new reply"
+
+def test_missing_or_foreign_file_is_ignored(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing")) == (0, 0)
+    other = tmp_path / "other"
+    other.write_bytes(b"not a snapshot file at all")
+    assert load_snapshot(str(other)) == (0, 0)
+
+def _snapshot_of(tmp_path, replies):
+    path = str(tmp_path / "cache.snapshot")
+    for i, reply in enumerate(replies):
+        cache_reply("linkedin", f"post {i}", reply)
+    save_snapshot(path)
+    cache.clear()
+    return path
+
+@pytest.mark.parametrize("damage", ["truncate", "flip"])
+def test_corrupt_snapshot_restores_nothing(tmp_path, monkeypatch, damage):
+    monkeypatch.setattr(app.cache_snapshot, "BLOCK_ENTRIES", 2)
+    path = _snapshot_of(tmp_path, [f"A reply long enough to be compressed, number {i}. " * 4 for i in range(5)])
+    data = bytearray(open(path, "rb").read())
+    if damage == "truncate":
+        data = data[:-7]
+    else:
+        # Inside the last block's compressed values, after earlier blocks restored fine
+        data[-5] ^= 0xFF
+    open(path, "wb").write(bytes(data))
+    errors = metrics_store["counters"].get("cache_restore_errors", 0)
+
+    assert load_snapshot(path) == (0, 0)
+    assert cache == {}
+    assert metrics_store["counters"]["cache_restore_errors"] == errors + 1
+
+def test_write_is_atomic_and_leaves_metrics_to_the_caller(tmp_path, monkeypatch):
+    def forbidden(*args):
+        raise AssertionError("metrics recorded off the event loop")
+
+    monkeypatch.setattr(app.cache_snapshot, "observe", forbidden)
+    monkeypatch.setattr(app.cache_snapshot, "set_gauge", forbidden)
+    path = str(tmp_path / "cache.snapshot")
+    cache_reply("twitter", "post", "reply")
+
+    assert write_snapshot(path, list(cache.items())) == 1
+    assert os.listdir(tmp_path) == ["cache.snapshot"]
+
+def test_lifespan_snapshots_on_shutdown_and_restores(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.snapshot")
+    monkeypatch.setattr(app.main, "CACHE_SNAPSHOT_PATH", path)
+    monkeypatch.setattr(app.main, "JOB_WORKERS", 0)
+
+    with TestClient(app.main.app):
+        cache_reply("twitter", "kept across restarts", "cached reply")
+    assert os.path.exists(path)
+
+    cache.clear()
+    with TestClient(app.main.app):
+        assert get_cached_reply("twitter", "kept across restarts") == "cached reply"
@@ -5,7 +5,7 @@ from bson import ObjectId
 from datetime import datetime, timezone
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
-from app.db import save_reply, database
+from app.db import save_reply, get_replies, database
 
 @pytest.mark.asyncio
 async def test_save_reply():
@@ -25,3 +25,52 @@ async def test_save_reply():
     # Retrieve and verify
     saved_reply = await database.replies.find_one({"_id": ObjectId(result_id)})
     assert saved_reply["generated_reply"] == "This is a test reply"
+
+@pytest.mark.asyncio
+async def test_save_reply_accepts_datetime_without_printing(capsys):
+    """The API passes a datetime directly and nothing is written to stdout per record"""
+    timestamp = datetime.now(timezone.utc)
+    result_id = await save_reply({
+        "platform": "linkedin",
+        "post_text": "A long post that should never be echoed to stdout",
+        "generated_reply": "Great insight",
+        "timestamp": timestamp
+    })
+
+    saved_reply = await database.replies.find_one({"_id": ObjectId(result_id)})
+    assert saved_reply["timestamp"] == timestamp
+    assert capsys.readouterr().out == ""
+
+@pytest.mark.asyncio
+async def test_post_text_is_stored_once(mock_db):
+    """Replies to the same post share one `posts` document"""
+    post = "Same long post " * 200
+    for platform in ("twitter", "linkedin"):
+        await save_reply({
+            "platform": platform,
+            "post_text": post,
+            "generated_reply": f"{platform} reply",
+            "timestamp": datetime.now(timezone.utc)
+        })
+
+    assert len(mock_db["posts"].stored) == 1
+    stored_post = next(iter(mock_db["posts"].stored.values()))
+    assert "text" not in stored_post and len(stored_post["data"]) < len(post)
+    assert all("post_text" not in reply for reply in mock_db["replies"].stored.values())
+
+@pytest.mark.asyncio
+async def test_get_replies_hydrates_with_one_lookup(mock_db):
+    posts = ["Short post", "Long post " * 300]
+    for post in posts:
+        await save_reply({
+            "platform": "twitter",
+            "post_text": post,
+            "generated_reply": "reply",
+            "timestamp": datetime.now(timezone.utc)
+        })
+    mock_db["posts"].calls.clear()
+
+    replies = await get_replies(limit=10)
+
+    assert sorted(reply["post_text"] for reply in replies) == sorted(posts)
+    assert mock_db["posts"].calls == ["find"]
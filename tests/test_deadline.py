@@ -0,0 +1,76 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+
+import app.deadline
+from app.ai import generate_reply
+from app.deadline import Deadline, DeadlineExceeded, ClientDisconnected, cancel_on_disconnect
+from app.metrics import metrics_store
+
+@pytest.fixture
+def slow_client(monkeypatch, stage_client):
+    """Fake client whose stages take the configured number of seconds; records the stages called"""
+    # Shrink the stage budgets so tests run in milliseconds
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "analyze", 0.05)
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "personalize", 0.05)
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "refine", 0.05)
+    return stage_client.delays, stage_client.calls
+
+def wasted(stage):
+    return metrics_store["counters"].get(f"wasted_upstream_calls_{stage}", 0)
+
+@pytest.mark.asyncio
+async def test_slow_refine_is_cut_short_and_draft_returned(slow_client):
+    delays, calls = slow_client
+    delays["refine"] = 5
+    before = wasted("refine")
+
+    reply = await generate_reply("twitter", "Shipped it!", deadline=Deadline(0.3))
+
+    assert reply == "personalize output"
+    assert calls == ["analyze", "personalize", "refine"]
+    assert wasted("refine") == before + 1
+
+@pytest.mark.asyncio
+async def test_analysis_skipped_when_budget_is_short(slow_client):
+    _, calls = slow_client
+
+    reply = await generate_reply("twitter", "Shipped it!", deadline=Deadline(0.08))
+
+    assert "analyze" not in calls
+    assert reply
+
+@pytest.mark.asyncio
+async def test_no_time_for_draft_raises(slow_client):
+    _, calls = slow_client
+
+    with pytest.raises(DeadlineExceeded):
+        await generate_reply("twitter", "Shipped it!", deadline=Deadline(0.01))
+    assert calls == []
+
+@pytest.mark.asyncio
+async def test_client_disconnect_cancels_generation(slow_client, monkeypatch):
+    delays, calls = slow_client
+    delays["analyze"] = 5
+    monkeypatch.setattr(app.deadline, "DISCONNECT_POLL_INTERVAL", 0.01)
+    before = wasted("analyze")
+
+    request = MagicMock()
+    async def is_disconnected():
+        return True
+    request.is_disconnected = is_disconnected
+
+    with pytest.raises(ClientDisconnected):
+        await cancel_on_disconnect(request, generate_reply("twitter", "Shipped it!"))
+
+    assert calls == ["analyze"]
+    assert wasted("analyze") == before + 1
+
+def test_platform_default_deadline_applies_without_header():
+    deadline = Deadline.for_request("linkedin")
+    assert deadline.seconds == app.deadline.PLATFORM_DEADLINES["linkedin"]
+    assert Deadline.for_request("linkedin", 3.0).seconds == 3.0
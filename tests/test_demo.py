@@ -0,0 +1,48 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import queue
+from datetime import datetime, timezone
+
+import httpx
+
+import app.demo
+import app.main
+from app.demo import DemoBackend
+from app.scheduler import AdmissionRejected
+
+async def test_rejected_stream_is_retried(monkeypatch):
+    attempts = []
+
+    async def generate_and_store(platform, post_text, *args, **kwargs):
+        attempts.append(platform)
+        if len(attempts) == 1:
+            raise AdmissionRejected("interactive queue is full")
+        return "Congrats on the launch!", datetime.now(timezone.utc)
+
+    real_sleep = asyncio.sleep
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+        await real_sleep(0)
+
+    monkeypatch.setattr(app.main, "generate_and_store", generate_and_store)
+    monkeypatch.setattr(app.demo.asyncio, "sleep", sleep)
+
+    # Skip the background loop; drive the stream against the app in-process
+    backend = DemoBackend.__new__(DemoBackend)
+    backend.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app.main.app), base_url="http://test")
+    events: queue.Queue = queue.Queue()
+    await backend._stream("twitter", "We launched!", events)
+    await backend.client.aclose()
+
+    received = []
+    while (event := events.get_nowait()) is not None:
+        received.append(event)
+    assert [event["event"] for event in received] == ["retry", "reply"]
+    assert received[0]["data"] == waits[0] == 2
+    assert received[1]["data"]["generated_reply"] == "Congrats on the launch!"
+    assert len(attempts) == 2
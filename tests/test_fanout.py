@@ -0,0 +1,88 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ai import fan_out_replies
+from app.cache import cache, cache_reply
+from app.main import app as api
+
+POST = "Just shipped our first open-source release after a year of nights and weekends!"
+
+@pytest.fixture
+def fake_mistral(stage_client):
+    """Answers analysis, fan-out and persona prompts; records the stage of each call"""
+    omit = set()
+
+    def respond(stage, messages):
+        if stage == "analyze":
+            return json.dumps({"tone": "excited", "intent": "celebrating", "topics": ["open source"]})
+        if stage == "fanout":
+            system = messages[0]["content"]
+            platforms = [p for p in ("linkedin", "twitter", "instagram") if f"- {p}:" in system and p not in omit]
+            return json.dumps({p: f"{p} reply" for p in platforms})
+        return "fallback reply"
+
+    stage_client.respond = respond
+    cache.clear()
+    yield stage_client.calls, omit
+    cache.clear()
+
+async def test_one_analysis_and_one_completion(fake_mistral):
+    calls, _ = fake_mistral
+    replies, savings = await fan_out_replies(["linkedin", "twitter", "instagram"], POST)
+
+    assert replies == {"linkedin": "linkedin reply", "twitter": "twitter reply", "instagram": "instagram reply"}
+    assert calls == ["analyze", "fanout"]
+    assert savings["calls_saved"] == 7
+    assert savings["tokens_saved"] > 0
+
+async def test_missing_platform_falls_back_to_persona_draft(fake_mistral):
+    calls, omit = fake_mistral
+    omit.add("twitter")
+    replies, savings = await fan_out_replies(["linkedin", "twitter"], POST)
+
+    assert replies == {"linkedin": "linkedin reply", "twitter": "fallback reply"}
+    assert calls == ["analyze", "fanout", "personalize"]
+    assert savings["calls_saved"] == 3
+
+def test_fanout_endpoint_caches_and_bulk_writes(fake_mistral, mock_db):
+    calls, _ = fake_mistral
+    cache_reply("instagram", POST, "cached instagram reply")
+
+    response = TestClient(api).post("/reply/fanout", json={"post_text": POST, "platforms": ["linkedin", "twitter", "insta"]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["replies"] == {
+        "linkedin": "linkedin reply", "twitter": "twitter reply", "instagram": "cached instagram reply"
+    }
+    assert data["cached_platforms"] == ["instagram"]
+    assert data["calls_saved"] == 4
+    assert calls == ["analyze", "fanout"]
+
+    # One write for all generated replies, each with its own cache entry
+    assert mock_db["replies"].calls == ["insert_many"]
+    assert sorted(doc["platform"] for doc in mock_db["replies"].stored.values()) == ["linkedin", "twitter"]
+    assert len(mock_db["posts"].stored) == 1
+
+    calls.clear()
+    response = TestClient(api).post("/reply/fanout", json={"post_text": POST})
+    assert response.json()["cached_platforms"] == ["linkedin", "twitter", "instagram"]
+    assert calls == []
+
+def test_fanout_platforms_are_case_insensitive_and_validated(fake_mistral, mock_db):
+    calls, _ = fake_mistral
+    client = TestClient(api)
+
+    response = client.post("/reply/fanout", json={"post_text": POST, "platforms": ["LinkedIn", "linkedin", " TWITTER "]})
+    assert response.status_code == 200
+    assert response.json()["replies"] == {"linkedin": "linkedin reply", "twitter": "twitter reply"}
+    assert calls == ["analyze", "fanout"]
+
+    response = client.post("/reply/fanout", json={"post_text": POST, "platforms": ["linkedin", "myspace"]})
+    assert response.status_code == 422
+    assert "myspace" in response.json()["detail"]
@@ -0,0 +1,244 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.jobs
+import app.main
+from app.jobs import JobWorkers, submit_job, get_job
+from app.main import app as api
+from app.transport import close_clients
+
+class CallbackServer:
+    """Local HTTP stand-in for a client's callback endpoint"""
+
+    def __init__(self):
+        self.received = []
+        received = self.received
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                received.append(json.loads(body))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/callback"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def callback_server(monkeypatch):
+    # The stand-in listens on loopback, which callbacks refuse by default
+    monkeypatch.setattr(app.jobs, "CALLBACK_ALLOW_PRIVATE", True)
+    server = CallbackServer()
+    yield server
+    server.close()
+
+async def test_job_completes_and_calls_back(callback_server):
+    async def handler(job):
+        return f"reply for {job['platform']}", datetime.now(timezone.utc)
+
+    workers = JobWorkers(handler, workers=1)
+    job_id = await submit_job("twitter", "Shipping day!", callback_server.url)
+
+    assert await workers.process_next("w1")
+    await workers.stop()
+
+    job = await get_job(job_id)
+    assert job["status"] == "done"
+    assert job["attempts"] == 1
+    assert job["finished_at"] == job["updated_at"]
+    assert job["generated_reply"] == "reply for twitter"
+    assert callback_server.received == [app.jobs.job_status(job)]
+    assert not await workers.process_next("w1")
+
+async def test_failed_job_is_retried_then_failed(monkeypatch, mock_db, callback_server):
+    monkeypatch.setattr(app.jobs, "JOB_MAX_ATTEMPTS", 2)
+
+    async def handler(job):
+        raise RuntimeError("upstream down")
+
+    workers = JobWorkers(handler, workers=1)
+    job_id = await submit_job("linkedin", "New role!", callback_server.url)
+
+    assert await workers.process_next("w1")
+    job = await get_job(job_id)
+    assert job["status"] == "queued"
+    assert job["available_at"] > datetime.now(timezone.utc)
+    # Not due yet
+    assert not await workers.process_next("w1")
+
+    mock_db["jobs"].stored[job_id]["available_at"] = datetime.now(timezone.utc)
+    assert await workers.process_next("w1")
+    await workers.stop()
+
+    job = await get_job(job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+    assert job["error"] == "upstream down"
+    assert callback_server.received[0]["status"] == "failed"
+
+async def test_expired_lease_is_reclaimed(mock_db):
+    job_id = await submit_job("instagram", "Beach day")
+    claimed = await app.jobs.claim_job("crashed-worker")
+    assert claimed["worker"] == "crashed-worker"
+    assert await app.jobs.claim_job("w2") is None
+
+    mock_db["jobs"].stored[job_id]["lease_until"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    reclaimed = await app.jobs.claim_job("w2")
+    assert reclaimed["_id"] == job_id
+    assert reclaimed["worker"] == "w2"
+    assert reclaimed["attempts"] == 2
+
+async def test_job_out_of_attempts_is_not_reclaimed(monkeypatch, mock_db, callback_server):
+    monkeypatch.setattr(app.jobs, "JOB_MAX_ATTEMPTS", 2)
+    job_id = await submit_job("linkedin", "Poison post", callback_server.url)
+    workers = JobWorkers(None, workers=1)
+
+    for attempt in range(2):
+        assert (await app.jobs.claim_job(f"w{attempt}"))["attempts"] == attempt + 1
+        # The worker hangs until its lease runs out
+        mock_db["jobs"].stored[job_id]["lease_until"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+    assert await app.jobs.claim_job("w2") is None
+    assert await workers.fail_abandoned() == 1
+    await workers.stop()
+
+    job = await get_job(job_id)
+    assert job["status"] == "failed"
+    assert "lease_until" not in job
+    assert callback_server.received[0]["status"] == "failed"
+
+async def test_stalled_worker_cannot_overwrite_reclaimed_job(mock_db, callback_server):
+    job_id = await submit_job("twitter", "Launch day", callback_server.url)
+    # Same worker id on two hosts, e.g. uvicorn as pid 1 in each container
+    stalled = await app.jobs.claim_job("1-0")
+
+    mock_db["jobs"].stored[job_id]["lease_until"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    reclaimed = await app.jobs.claim_job("1-0")
+    assert reclaimed["lease"] != stalled["lease"]
+
+    async def handler(job):
+        return "late reply", datetime.now(timezone.utc)
+
+    workers = JobWorkers(handler, workers=1)
+    await workers._process(stalled)
+    await workers._fail(stalled, RuntimeError("late failure"))
+    await workers.stop()
+
+    job = await get_job(job_id)
+    assert job["status"] == "running"
+    assert job["lease"] == reclaimed["lease"]
+    assert "generated_reply" not in job
+    assert callback_server.received == []
+
+async def test_indexes_cover_polling_and_expire_finished_jobs(mock_db):
+    await app.jobs.ensure_job_indexes()
+
+    assert mock_db["jobs"].indexes == [
+        ([("status", 1), ("available_at", 1)], {}),
+        ("lease_until", {}),
+        ("finished_at", {"expireAfterSeconds": app.jobs.JOB_RETENTION_SECONDS})
+    ]
+
+def test_startup_does_not_wait_for_job_indexes(monkeypatch):
+    started = asyncio.Event()
+
+    async def unreachable_mongo():
+        # Server selection against an unreachable MONGO_URI takes ~30s
+        started.set()
+        await asyncio.sleep(30)
+
+    monkeypatch.setattr(app.main, "ensure_job_indexes", unreachable_mongo)
+    monkeypatch.setattr(app.main, "JOB_WORKERS", 0)
+
+    start = time.monotonic()
+    with TestClient(api) as client:
+        assert client.get("/metrics").status_code == 200
+    assert time.monotonic() - start < 5
+    assert started.is_set()
+
+def test_submit_and_poll_job_endpoints(mock_db):
+    client = TestClient(api)
+    response = client.post(
+        "/jobs",
+        json={"platform": "insta", "post_text": "Sunset", "callback_url": "http://example.test/hook"}
+    )
+    assert response.status_code == 202
+    data = response.json()
+    assert data["status"] == "queued"
+    assert data["platform"] == "instagram"
+
+    stored = mock_db["jobs"].stored[data["job_id"]]
+    assert stored["priority"] == "bulk"
+    assert stored["callback_url"] == "http://example.test/hook"
+
+    response = client.get(f"/jobs/{data['job_id']}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+
+    assert client.get("/jobs/missing").status_code == 404
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://10.0.0.5/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/hook",
+    "ftp://example.com/hook",
+    "not a url"
+])
+def test_callback_url_must_be_public_http(url):
+    response = TestClient(api).post("/jobs", json={"platform": "twitter", "post_text": "Hi", "callback_url": url})
+    assert response.status_code == 422
+
+async def test_callback_to_private_address_is_refused(monkeypatch, callback_server):
+    monkeypatch.setattr(app.jobs, "CALLBACK_ALLOW_PRIVATE", False)
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(app.jobs.asyncio, "sleep", sleep)
+    workers = JobWorkers(None, workers=1)
+    job = {"_id": "j1", "status": "done", "platform": "twitter"}
+
+    # Names are checked once resolved; malformed URLs are refused, not raised
+    for url in (callback_server.url.replace("127.0.0.1", "localhost"), "http://[::1"):
+        await workers._callback(dict(job, callback_url=url))
+    await close_clients()
+
+    assert callback_server.received == []
+    assert slept == []
+
+async def test_callback_does_not_sleep_after_last_attempt(monkeypatch):
+    monkeypatch.setattr(app.jobs, "CALLBACK_ALLOW_PRIVATE", True)
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(app.jobs.asyncio, "sleep", sleep)
+    workers = JobWorkers(None, workers=1)
+    # Nothing listens on port 9 (discard) locally, so every attempt fails to connect
+    await workers._callback({"_id": "j1", "status": "done", "platform": "twitter", "callback_url": "http://127.0.0.1:9/hook"})
+    await close_clients()
+
+    assert slept == [1, 2]
@@ -0,0 +1,71 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import multiprocessing
+
+import app.metrics
+from app.metrics import get_metrics_summary
+
+WORKERS = 4
+REQUESTS_PER_WORKER = 250
+
+def simulate_worker(directory, started, release):
+    """Run in a separate process: record requests the way the API does"""
+    import app.metrics as metrics
+    metrics.METRICS_MULTIPROC_DIR = directory
+
+    async def record():
+        for i in range(REQUESTS_PER_WORKER):
+            await metrics.log_request(
+                platform="twitter" if i % 2 else "linkedin",
+                post_text="post",
+                cached=i % 5 == 0,
+                start_time=0.0,
+                end_time=0.2,
+                reply_length=10
+            )
+    asyncio.run(record())
+    metrics.set_gauge("scheduler_queue_depth_bulk", 3)
+
+    started.set()
+    release.wait()
+
+def test_workers_aggregate_exactly(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    ctx = multiprocessing.get_context("spawn")
+    release = ctx.Event()
+    workers = []
+    for _ in range(WORKERS):
+        started = ctx.Event()
+        process = ctx.Process(target=simulate_worker, args=(directory, started, release))
+        process.start()
+        workers.append((process, started))
+    for _, started in workers:
+        assert started.wait(60)
+
+    monkeypatch.setattr(app.metrics, "METRICS_MULTIPROC_DIR", directory)
+    summary = get_metrics_summary()
+
+    total = WORKERS * REQUESTS_PER_WORKER
+    assert summary["total_requests"] == total
+    assert summary["counters"]["cache_hits"] == WORKERS * (REQUESTS_PER_WORKER // 5)
+    assert summary["platform_distribution"] == {
+        "linkedin": total // 2, "twitter": total // 2, "instagram": 0
+    }
+    assert summary["histograms"]["generation_seconds"]["count"] == total
+    assert summary["histograms"]["generation_seconds"]["buckets"]["0.25"] == total
+    assert summary["avg_reply_length"] == 10
+    # Gauges from live workers are summed
+    assert summary["gauges"]["scheduler_queue_depth_bulk"] == 3 * WORKERS
+
+    release.set()
+    for process, _ in workers:
+        process.join(30)
+
+    # Counters survive worker exit; gauges of exited workers are dropped
+    summary = get_metrics_summary()
+    assert summary["total_requests"] == total
+    assert "scheduler_queue_depth_bulk" not in summary["gauges"]
@@ -0,0 +1,90 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main
+import app.profiling
+from app.profiling import LoopLagMonitor, record_stage, sample_stacks
+
+client = TestClient(app.main.app)
+ADMIN = {"X-Admin-Token": "secret"}
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch):
+    monkeypatch.setattr(app.main, "ADMIN_TOKEN", "secret")
+    app.profiling.slow_requests.clear()
+
+def test_admin_endpoints_require_token(monkeypatch):
+    assert client.get("/admin/slow-requests").status_code == 403
+    assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/slow-requests", headers=ADMIN).status_code == 200
+
+    monkeypatch.setattr(app.main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/loop-lag", headers=ADMIN).status_code == 403
+
+def test_slow_requests_keep_stage_breakdown(monkeypatch):
+    monkeypatch.setattr(app.profiling, "SLOW_REQUEST_THRESHOLD", 0.05)
+
+    async def slow_generate_reply(platform, post_text, deadline=None, on_stage=None):
+        await asyncio.sleep(0.06)
+        record_stage("mistral_personalize", 0.06)
+        return "slow reply"
+
+    monkeypatch.setattr(app.main, "generate_reply", slow_generate_reply)
+    response = client.post("/reply", json={"platform": "linkedin", "post_text": "A post that takes a while"})
+    assert response.status_code == 200
+    # Fast requests are not kept
+    assert client.get("/metrics").status_code == 200
+
+    captured = client.get("/admin/slow-requests", headers=ADMIN).json()
+    assert len(captured) == 1
+    entry = captured[0]
+    assert entry["path"] == "/reply"
+    assert entry["status"] == 200
+    assert entry["seconds"] >= 0.06
+    stages = [stage["stage"] for stage in entry["stages"]]
+    assert stages == ["mistral_personalize", "db_save"]
+
+def test_ring_buffer_is_bounded():
+    for i in range(app.profiling.SLOW_REQUEST_BUFFER + 5):
+        app.profiling.slow_requests.append({"n": i})
+    assert len(app.profiling.slow_requests) == app.profiling.SLOW_REQUEST_BUFFER
+    assert app.profiling.slow_requests[0]["n"] == 5
+
+def busy_worker_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_sampling_profiler_returns_collapsed_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_worker_function, args=(stop,), name="busy")
+    worker.start()
+    try:
+        collapsed = sample_stacks(0.2, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = collapsed.splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("busy_worker_function (test_profiling.py" in line for line in busy)
+
+async def test_loop_lag_monitor_sees_blocking_call():
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.03)
+    time.sleep(0.1)  # block the loop
+    await asyncio.sleep(0.03)
+    await monitor.stop()
+
+    summary = monitor.summary()
+    assert summary["samples"] >= 2
+    assert summary["max_seconds"] >= 0.05
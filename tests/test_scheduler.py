@@ -0,0 +1,121 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from app.scheduler import AdmissionScheduler, AdmissionRejected, PriorityClass
+from app.metrics import metrics_store
+
+def make_scheduler(capacity=1, interactive_queue=10, bulk_queue=10, deadline=60):
+    classes = {
+        "interactive": PriorityClass("interactive", weight=3, max_queue=interactive_queue, deadline=deadline),
+        "bulk": PriorityClass("bulk", weight=1, max_queue=bulk_queue, deadline=deadline),
+    }
+    scheduler = AdmissionScheduler(capacity=capacity, classes=classes)
+    scheduler.avg_service_time = 0.01
+    return scheduler
+
+async def run_in_order(scheduler, requests):
+    """Queue `requests` behind a held slot, release it and return the order they were served in"""
+    served = []
+    await scheduler.acquire("interactive", "holder")
+
+    async def worker(priority, tenant, label):
+        async with scheduler.slot(priority, tenant):
+            served.append(label)
+
+    tasks = [asyncio.create_task(worker(*request)) for request in requests]
+    await asyncio.sleep(0)
+    scheduler.release(0.01)
+    await asyncio.gather(*tasks)
+    return served
+
+@pytest.mark.asyncio
+async def test_interactive_gets_weighted_share_over_bulk():
+    """With both classes backlogged, interactive is served 3:1 against bulk"""
+    scheduler = make_scheduler()
+    requests = [("bulk", "importer", f"b{i}") for i in range(4)] + \
+               [("interactive", "user", f"i{i}") for i in range(6)]
+
+    served = await run_in_order(scheduler, requests)
+
+    first_eight = served[:8]
+    assert sum(label.startswith("i") for label in first_eight) == 6
+    assert sum(label.startswith("b") for label in first_eight) == 2
+
+@pytest.mark.asyncio
+async def test_tenants_share_a_class_fairly():
+    """One tenant's burst doesn't starve another tenant in the same class"""
+    scheduler = make_scheduler()
+    requests = [("bulk", "big", f"big{i}") for i in range(5)] + [("bulk", "small", "small0")]
+
+    served = await run_in_order(scheduler, requests)
+
+    assert served.index("small0") <= 1
+
+@pytest.mark.asyncio
+async def test_idle_tenants_are_forgotten():
+    """Tenant names come from request headers, so drained flows must not keep state"""
+    scheduler = make_scheduler()
+    requests = [("bulk", f"tenant{i}", f"t{i}") for i in range(10)]
+
+    await run_in_order(scheduler, requests)
+
+    for queue in [scheduler.class_queue, *scheduler.tenant_queues.values()]:
+        assert queue.flows == {}
+        assert queue.tags == {}
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected():
+    scheduler = make_scheduler(bulk_queue=1)
+    await scheduler.acquire("interactive", "holder")
+    waiting = asyncio.create_task(scheduler.acquire("bulk", "a"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await scheduler.acquire("bulk", "b")
+    assert excinfo.value.status_code == 429
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    assert scheduler.queue_depth("bulk") == 0
+
+@pytest.mark.asyncio
+async def test_unmeetable_deadline_is_rejected_before_queueing():
+    scheduler = make_scheduler()
+    scheduler.avg_service_time = 5.0
+    await scheduler.acquire("interactive", "holder")
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await scheduler.acquire("interactive", "user", deadline=2.0)
+    assert excinfo.value.status_code == 503
+    assert scheduler.queue_depth("interactive") == 0
+
+@pytest.mark.asyncio
+async def test_wait_time_and_depth_are_recorded():
+    scheduler = make_scheduler()
+    await run_in_order(scheduler, [("bulk", "importer", "b0")])
+
+    assert metrics_store["histograms"]["scheduler_wait_seconds_bulk"]["count"] >= 1
+    assert metrics_store["gauges"]["scheduler_queue_depth_bulk"] == 0
+
+def test_reply_endpoint_maps_rejection_to_status():
+    from app.main import app
+
+    async def reject(*args, **kwargs):
+        raise AdmissionRejected("bulk queue is full", status_code=429)
+
+    with patch("app.main.get_cached_reply", return_value=None), \
+         patch("app.main.scheduler.acquire", reject):
+        response = TestClient(app).post(
+            "/reply",
+            json={"platform": "twitter", "post_text": "Bulk import row"},
+            headers={"X-Priority": "bulk", "X-Tenant-ID": "importer"}
+        )
+
+    assert response.status_code == 429
+    assert "queue is full" in response.json()["detail"]
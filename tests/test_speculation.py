@@ -0,0 +1,105 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import json
+
+import pytest
+
+import app.ai
+import app.deadline
+from app.ai import analysis_similarity, generate_reply, PLATFORM_DEFAULT_ANALYSIS
+from app.deadline import Deadline
+from app.metrics import metrics_store
+
+@pytest.fixture
+def speculative_client(monkeypatch, stage_client):
+    """Fake client: each stage sleeps for its delay; drafts echo the tone they were prompted with"""
+    stage_client.delays.update(analyze=0.1, personalize=0.1)
+    analysis = {"tone": "casual", "intent": "sharing", "audience": "general public", "topics": ["coffee"]}
+
+    def respond(stage, messages):
+        if stage == "analyze":
+            return json.dumps(analysis)
+        if stage == "personalize":
+            tone = messages[0]["content"].split("- Tone: ")[1].split("\n")[0]
+            return f"draft in a {tone} tone"
+        return messages[1]["content"]
+
+    stage_client.respond = respond
+    monkeypatch.setattr(app.ai, "SPECULATIVE_DRAFT", True)
+    return stage_client.delays, analysis, stage_client.calls
+
+def counter(name):
+    return metrics_store["counters"].get(name, 0)
+
+def test_similarity_uses_coarse_fields():
+    expected = PLATFORM_DEFAULT_ANALYSIS["linkedin"]
+    assert analysis_similarity({"tone": "Professional, proud", "intent": "sharing news", "audience": "professionals"}, expected) == 1.0
+    assert analysis_similarity({"tone": "frustrated", "intent": "venting", "audience": "friends"}, expected) == 0.0
+    assert analysis_similarity("not a dict", expected) == 0.0
+
+async def test_speculative_prompt_leaves_topics_to_the_post(speculative_client, stage_client):
+    await generate_reply("twitter", "Third coffee today")
+
+    drafts = [messages[0]["content"] for stage, messages in zip(stage_client.calls, stage_client.sent) if stage == "personalize"]
+    assert "- Tone: casual" in drafts[0]
+    assert "Main topics" not in drafts[0]
+
+async def test_matching_analysis_keeps_speculative_draft(speculative_client):
+    _, _, calls = speculative_client
+    hits = counter("speculation_hits_twitter")
+    saved = metrics_store["histograms"].get("speculation_saved_seconds_twitter", {"sum": 0.0})["sum"]
+    stages = []
+
+    start = asyncio.get_running_loop().time()
+    reply = await generate_reply("twitter", "Third coffee today", on_stage=lambda stage, _: stages.append(stage))
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert reply == "draft in a casual tone"
+    assert sorted(calls) == ["analyze", "personalize", "refine"]
+    assert stages == ["analysis", "draft"]
+    assert elapsed < 0.18  # analysis and draft overlapped
+    assert counter("speculation_hits_twitter") == hits + 1
+    assert metrics_store["histograms"]["speculation_saved_seconds_twitter"]["sum"] - saved >= 0.05
+
+async def test_mismatch_cancels_and_redrafts(speculative_client):
+    _, analysis, calls = speculative_client
+    analysis.update(tone="furious", intent="venting", audience="airline")
+    misses = counter("speculation_misses_twitter")
+    wasted = counter("wasted_upstream_calls_personalize")
+
+    reply = await generate_reply("twitter", "Flight cancelled again")
+
+    assert reply == "draft in a furious tone"
+    assert sorted(calls) == ["analyze", "personalize", "personalize", "refine"]
+    assert counter("speculation_misses_twitter") == misses + 1
+    # The speculative draft was still running and was abandoned
+    assert counter("wasted_upstream_calls_personalize") == wasted + 1
+
+async def test_skipped_analysis_keeps_speculative_draft(speculative_client, monkeypatch):
+    _, _, calls = speculative_client
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "analyze", 5)
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "personalize", 0.05)
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "refine", 0.05)
+
+    reply = await generate_reply("linkedin", "New role!", deadline=Deadline(1))
+
+    assert reply == "draft in a professional tone"
+    assert calls == ["personalize", "refine"]
+
+async def test_timed_out_analysis_keeps_speculative_draft(speculative_client, monkeypatch):
+    delays, _, calls = speculative_client
+    delays["analyze"] = 5
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "analyze", 0.05)
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "personalize", 0.05)
+    monkeypatch.setitem(app.deadline.STAGE_MIN_BUDGET, "refine", 0.05)
+    hits = counter("speculation_hits_linkedin")
+
+    # The neutral fallback analysis doesn't resemble LinkedIn's default, but it isn't a real analysis either
+    reply = await generate_reply("linkedin", "Promoted to staff engineer", deadline=Deadline(0.6))
+
+    assert reply == "draft in a professional tone"
+    assert calls.count("personalize") == 1
+    assert counter("speculation_hits_linkedin") == hits + 1
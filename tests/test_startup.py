@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# Cumulative import time allowed for `app.main`, in milliseconds (FastAPI itself is most of it)
+IMPORT_BUDGET_MS = int(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+# Heavy dependencies that must only load on first use, never at import
+LAZY_MODULES = ("mistralai", "motor", "pymongo", "dotenv")
+
+def import_times(module: str) -> dict:
+    """Import `module` in a fresh interpreter with -X importtime and return cumulative times in microseconds"""
+    env = {k: v for k, v in os.environ.items() if k != "MISTRAL_API_KEY"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        times[name] = int(cumulative_us)
+    return times
+
+def test_app_main_imports_without_secrets_or_heavy_clients():
+    """Importing the API must not need MISTRAL_API_KEY or load the SDK/DB clients"""
+    times = import_times("app.main")
+
+    loaded = [name for name in times if name.split(".")[0] in LAZY_MODULES]
+    assert loaded == [], f"Imported eagerly: {loaded}"
+
+def test_app_main_import_time_budget():
+    """Catch import-time regressions in the API entry point"""
+    times = import_times("app.main")
+
+    assert times["app.main"] / 1000 < IMPORT_BUDGET_MS, (
+        f"import app.main took {times['app.main'] / 1000:.0f}ms (budget {IMPORT_BUDGET_MS}ms)"
+    )
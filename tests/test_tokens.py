@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import pytest
+
+from app.ai import analyze_post
+from app.tokens import estimate_tokens, truncate_post, STAGE_INPUT_BUDGETS
+from app.metrics import metrics_store
+
+LONG_ARTICLE = (
+    "After ten years in product management, I'm leaving my job to start a company. "
+    + "Here is a long story about the journey and everything I learned along the way. " * 80
+    + "What would you have done differently in my position? "
+    + "Thanks to everyone who supported me. #startups #leadership"
+)
+
+def test_estimate_grows_with_text():
+    assert estimate_tokens("") == 0
+    assert 0 < estimate_tokens("Short post") < estimate_tokens(LONG_ARTICLE)
+
+def test_short_posts_are_untouched():
+    post = "Just adopted a puppy! #dogs"
+    assert truncate_post(post, 100) is post
+
+def test_truncation_keeps_lead_questions_and_hashtags():
+    truncated = truncate_post(LONG_ARTICLE, 120)
+
+    assert estimate_tokens(truncated) <= 120
+    assert truncated.startswith("After ten years in product management")
+    assert "What would you have done differently in my position?" in truncated
+    assert "#startups" in truncated and "#leadership" in truncated
+
+def test_whitespace_only_post_truncates_to_empty():
+    assert truncate_post(" " * 5000, 100) == ""
+    assert truncate_post("\n\t " * 2000, 100) == ""
+
+@pytest.mark.asyncio
+async def test_long_post_is_truncated_before_prompting(stage_client):
+    stage_client.respond = lambda stage, messages: "{}"
+    saved_before = metrics_store["counters"].get("prompt_tokens_saved_analyze", 0)
+
+    await analyze_post(LONG_ARTICLE)
+
+    assert estimate_tokens(stage_client.sent[0][-1]["content"]) <= STAGE_INPUT_BUDGETS["analyze"]
+    assert metrics_store["counters"]["prompt_tokens_saved_analyze"] > saved_before
@@ -0,0 +1,77 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app.ai
+from app.metrics import metrics_store
+from app.transport import close_clients, get_async_client
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+async def test_one_client_per_loop_and_name():
+    client = get_async_client("test-loop")
+    assert get_async_client("test-loop") is client
+    assert get_async_client("other") is not client
+
+    # A different loop (e.g. the demo's background thread) gets its own client
+    other_loop_client = await asyncio.to_thread(lambda: asyncio.run(_client_in_new_loop()))
+    assert other_loop_client is not client
+
+    await close_clients()
+    assert client.is_closed
+    assert get_async_client("test-loop") is not client
+    await close_clients()
+
+async def _client_in_new_loop():
+    client = get_async_client("test-loop")
+    await close_clients()
+    return client
+
+async def test_connections_are_reused(server_url):
+    counters = metrics_store["counters"]
+    for key in ("http_requests_reuse", "http_connections_new_reuse", "http_connections_reused_reuse"):
+        counters.pop(key, None)
+
+    client = get_async_client("reuse", base_url=server_url)
+    for _ in range(5):
+        response = await client.get("/")
+        assert response.text == "ok"
+    await close_clients()
+
+    assert counters["http_requests_reuse"] == 5
+    assert counters["http_connections_new_reuse"] == 1
+    assert counters["http_connections_reused_reuse"] == 4
+
+async def test_mistral_client_is_per_loop(monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "test-key")
+    client = app.ai.get_client()
+    assert app.ai.get_client() is client
+    assert client.sdk_configuration.async_client is get_async_client("mistral")
+    await close_clients()
+    assert app.ai.get_client() is not client
+    await close_clients()